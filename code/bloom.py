@@ -0,0 +1,126 @@
+# A Bloom filter over a set of string keys, saved to a file and memory-mapped
+# when it's loaded, so a lookup that's definitely going to miss can be skipped
+# without touching the database.
+#
+# A filter is a dict with the bit array and its parameters, like the stages in
+# metrics.py. Bit positions come from double hashing a single BLAKE2b digest of
+# the key.
+
+import hashlib
+import math
+import mmap
+import os
+import struct
+
+HEADER_FORMAT = '<8sqqqd'
+MAGIC = b'BLOOM001'
+
+def getFilterSize(numKeys, fpRate):
+  """Gets the optimal (numBits, numHashes) for a number of keys and a target
+  false positive rate."""
+  numKeys = max(1, numKeys)
+  numBits = math.ceil(-numKeys * math.log(fpRate) / math.log(2) ** 2)
+  numHashes = max(1, round(numBits / numKeys * math.log(2)))
+  return numBits, numHashes
+
+def newFilter(numKeys, fpRate):
+  """Creates an empty filter sized for numKeys keys at the given target false
+  positive rate."""
+  numBits, numHashes = getFilterSize(numKeys, fpRate)
+  return {
+    'bits': bytearray((numBits + 7) // 8),
+    'numBits': numBits,
+    'numHashes': numHashes,
+    'numKeys': 0,
+    'fpRate': fpRate,
+  }
+
+def getBitPositions(bloomFilter, key):
+  digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+  hash1, hash2 = struct.unpack('<QQ', digest)
+  numBits = bloomFilter['numBits']
+  return [
+    (hash1 + i * hash2) % numBits for i in range(bloomFilter['numHashes'])
+  ]
+
+def addKey(bloomFilter, key):
+  bits = bloomFilter['bits']
+  for position in getBitPositions(bloomFilter, key):
+    bits[position >> 3] |= 1 << (position & 7)
+  bloomFilter['numKeys'] += 1
+
+def mightContain(bloomFilter, key):
+  """Checks whether the key might be in the filter.
+
+  Returns: False if the key was definitely never added, True otherwise.
+  """
+  bits = bloomFilter['bits']
+  for position in getBitPositions(bloomFilter, key):
+    if not bits[position >> 3] & (1 << (position & 7)):
+      return False
+  return True
+
+def estimateFalsePositiveRate(bloomFilter):
+  """Estimates the false positive rate from the number of keys added."""
+  numBits = bloomFilter['numBits']
+  numHashes = bloomFilter['numHashes']
+  numKeys = bloomFilter['numKeys']
+  return (1 - math.exp(-numHashes * numKeys / numBits)) ** numHashes
+
+def formatStats(bloomFilter):
+  """Formats a one-line summary of the filter's size and false positive rate."""
+  return (
+    '{numKeys} keys, {numBytes} bytes, {numHashes} hashes, target false '
+    'positive rate {fpRate}, estimated {estimate:.4g}'
+  ).format(
+    numKeys=bloomFilter['numKeys'],
+    numBytes=len(bloomFilter['bits']),
+    numHashes=bloomFilter['numHashes'],
+    fpRate=bloomFilter['fpRate'],
+    estimate=estimateFalsePositiveRate(bloomFilter)
+  )
+
+def saveFilter(bloomFilter, path):
+  # The file is replaced rather than overwritten, so processes that have the old
+  # one mapped keep reading it.
+  tempPath = path + '.tmp'
+  with open(tempPath, 'wb') as filterFile:
+    filterFile.write(struct.pack(
+      HEADER_FORMAT,
+      MAGIC,
+      bloomFilter['numBits'],
+      bloomFilter['numHashes'],
+      bloomFilter['numKeys'],
+      bloomFilter['fpRate']
+    ))
+    filterFile.write(bloomFilter['bits'])
+  os.replace(tempPath, path)
+
+def loadFilter(path, writable=False):
+  """Memory-maps a filter written by saveFilter().
+
+  Args:
+    path: The path of the filter.
+    writable: If true, the filter is read into memory instead, so keys can be
+      added to it and it can be saved again.
+  """
+  with open(path, 'rb') as filterFile:
+    mapped = mmap.mmap(filterFile.fileno(), 0, access=mmap.ACCESS_READ)
+  headerSize = struct.calcsize(HEADER_FORMAT)
+  magic, numBits, numHashes, numKeys, fpRate = struct.unpack(
+    HEADER_FORMAT, mapped[:headerSize]
+  )
+  if magic != MAGIC:
+    raise ValueError('{} is not a Bloom filter file.'.format(path))
+  if writable:
+    bits = bytearray(mapped[headerSize:])
+    mapped.close()
+  else:
+    bits = memoryview(mapped)[headerSize:]
+  return {
+    'bits': bits,
+    'numBits': numBits,
+    'numHashes': numHashes,
+    'numKeys': numKeys,
+    'fpRate': fpRate,
+  }
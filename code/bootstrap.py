@@ -0,0 +1,132 @@
+# Bootstrap confidence intervals for precision, recall and F1. Every threshold
+# setting is evaluated against every resample at once: the resamples are stored
+# as a matrix of per-row weights, so the counts for the whole threshold grid
+# come out of a couple of matrix products instead of a loop per resample.
+
+import numpy as np
+
+NUM_RESAMPLES = 2000
+CONFIDENCE = 0.95
+# Resamples are drawn from a fixed seed, so the intervals are the same on every
+# run.
+SEED = 0
+
+def getResampleWeights(groupIds, numResamples=NUM_RESAMPLES, seed=SEED):
+  """Draws bootstrap resamples of groups of rows.
+
+  Groups (e.g. test entities) are drawn with replacement, and each row is
+  weighted by the number of times its group was drawn. Pass a distinct group ID
+  per row to resample the rows themselves.
+
+  Args:
+    groupIds: A sequence of ints in [0, numGroups), one per row.
+    numResamples: The number of resamples to draw.
+    seed: The seed for the random number generator.
+
+  Returns: A (numResamples, numRows) array of row weights.
+  """
+  groupIds = np.asarray(groupIds)
+  numGroups = groupIds.max() + 1
+  rng = np.random.default_rng(seed)
+  draws = rng.integers(0, numGroups, size=(numResamples, numGroups))
+  # Offset each resample's draws so one bincount counts all of them.
+  draws += np.arange(numResamples)[:, np.newaxis] * numGroups
+  groupWeights = np.bincount(
+    draws.ravel(),
+    minlength=numResamples * numGroups
+  ).reshape(numResamples, numGroups)
+  return groupWeights[:, groupIds]
+
+def getPrIntervals(returned, hits, relevant, weights, confidence=CONFIDENCE):
+  """Computes bootstrap confidence intervals over a grid of settings.
+
+  Args:
+    returned: A (numSettings, numRows) boolean array of which rows each setting
+      returns.
+    hits: A boolean array with one entry per row, true if the row is correct
+      when it's returned.
+    relevant: A boolean array with one entry per row, true if the row counts
+      towards the recall denominator.
+    weights: A (numResamples, numRows) array from getResampleWeights().
+    confidence: The coverage of the intervals.
+
+  Returns: A tuple of (precisionLow, precisionHigh, recallLow, recallHigh,
+    f1Low, f1High) arrays, each with one entry per setting. Resamples where a
+    value is undefined are ignored, and the bounds are nan if it's undefined in
+    every resample.
+  """
+  returned = np.asarray(returned, dtype=np.float64)
+  hits = np.asarray(hits, dtype=np.float64)
+  relevant = np.asarray(relevant, dtype=np.float64)
+  weights = np.asarray(weights, dtype=np.float64)
+
+  returnedCounts = weights @ returned.T
+  correctCounts = weights @ (returned * hits).T
+  totalCorrectCounts = (weights @ relevant)[:, np.newaxis]
+
+  with np.errstate(divide='ignore', invalid='ignore'):
+    precision = correctCounts / returnedCounts
+    recall = correctCounts / totalCorrectCounts
+    f1 = 2 * precision * recall / (precision + recall)
+  f1[(precision == 0) & (recall == 0)] = 0
+
+  alpha = 1 - confidence
+  percentiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+  intervals = []
+  for values in [precision, recall, f1]:
+    low, high = nanPercentiles(values, percentiles)
+    intervals.extend([low, high])
+  return tuple(intervals)
+
+def nanPercentiles(values, percentiles):
+  """Gets percentiles of each column, ignoring nans.
+
+  Columns that are all nan get nan percentiles instead of a warning.
+  """
+  values = np.where(np.isfinite(values), values, np.nan)
+  result = np.full((len(percentiles), values.shape[1]), np.nan)
+  defined = ~np.all(np.isnan(values), axis=0)
+  if np.any(defined):
+    result[:, defined] = np.nanpercentile(
+      values[:, defined], percentiles, axis=0
+    )
+  return result[0], result[1]
+
+def getThresholdIntervals(linkStats, thresholds, numResamples=NUM_RESAMPLES,
+    confidence=CONFIDENCE, byEntity=True, seed=SEED):
+  """Computes confidence intervals for runExperiment() over a threshold grid.
+
+  Args:
+    linkStats: A list of link stats tuples from readLinkStatsFile().
+    thresholds: A list of (cprobThreshold, countThreshold, tupleThreshold)
+      tuples.
+    numResamples: The number of bootstrap resamples.
+    confidence: The coverage of the intervals.
+    byEntity: If true, test entities are resampled along with all of their
+      rows. Otherwise, the rows are resampled independently.
+    seed: The seed for the random number generator.
+
+  Returns: A list with a (precisionLow, precisionHigh, recallLow, recallHigh,
+    f1Low, f1High) tuple for each threshold tuple.
+  """
+  entities = [line[0] for line in linkStats]
+  isCorrect = np.array([line[2] for line in linkStats], dtype=bool)
+  cprobs = np.array([line[3] for line in linkStats])
+  cwCounts = np.array([line[5] for line in linkStats])
+  tupleCounts = np.array([line[6] for line in linkStats])
+
+  thresholds = np.array(thresholds, dtype=np.float64)
+  returned = (
+    (cprobs > thresholds[:, 0:1])
+    & (cwCounts > thresholds[:, 1:2])
+    & (tupleCounts > thresholds[:, 2:3])
+  )
+
+  if byEntity:
+    _, groupIds = np.unique(entities, return_inverse=True)
+  else:
+    groupIds = np.arange(len(linkStats))
+  weights = getResampleWeights(groupIds, numResamples, seed)
+  intervals = getPrIntervals(returned, isCorrect, isCorrect, weights,
+    confidence)
+  return list(zip(*[values.tolist() for values in intervals]))
@@ -0,0 +1,629 @@
+# Builds derived layouts of the Crosswikis database.
+#
+# Sharding: splits the tables in constants.CROSSWIKIS_DB_PATH across N database
+# files, partitioned by a hash of the case-folded key of each table (see
+# crosswikis.getShardKeyColumn()). Set constants.CROSSWIKIS_NUM_SHARDS to N
+# afterwards to make crosswikis read from the shards.
+#
+# Forward dump: loads the forward table from the raw dictionary dump and derives
+# the inverse table from it in the same pass, instead of loading inv.dict
+# separately. The forward rows are sorted by entity with an external sort, and
+# each entity's p(string|entity) and label denominators are computed from its
+# group. checkConsistency() verifies that the numerators of the two tables
+# agree.
+#
+# Normalized keys: adds an indexed norm_anchor column to the forward tables,
+# holding crosswikis.normalizeString() of each anchor, for
+# crosswikis.getEntityDistribution(normalized=True).
+#
+# Anchor features: builds a feature table for each forward table (see
+# crosswikis.getAnchorFeatures()), keyed by the case-folded anchor, with the
+# top entities and the shape of the entity distribution of each anchor, so
+# evaluators don't have to pull and sort whole distributions.
+#
+# Bloom filters: writes Bloom filters over the case-folded anchors and the
+# entities of the full tables, which crosswikis uses to skip lookups that are
+# sure to find nothing. Rebuild them whenever the tables change.
+#
+# ID maps: interns every entity and case-folded anchor of the full forward table
+# into the ID maps persisted by the ids module. Existing IDs are kept.
+
+import bloom
+import concurrent.futures
+import constants
+import crosswikis
+import ids
+import itertools
+import json
+import math
+import multiprocessing
+import myutils
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+TABLES = [
+  'crosswikis',
+  'crosswikis_inv',
+  'crosswikis_subset',
+  'crosswikis_inv_subset',
+]
+
+FORWARD_TABLES = [table for table in TABLES if not table.startswith(
+  'crosswikis_inv')]
+
+FORWARD_DUMP_PATH = constants.DATA_PATH + 'google-crosswikis/dictionary'
+
+# How many rows to buffer per shard or table before inserting them.
+INSERT_BATCH_SIZE = 10000
+
+# The most lines to sort in memory before spilling a sorted run to disk.
+SPILL_MAX_LINES = 5000000
+
+LABELS = ['W:', 'Wx:', 'w:', 'w\':']
+
+# The number of top entities of each anchor to keep in the feature tables.
+FEATURES_TOP_K = 5
+
+FORWARD_TABLE_SQL = (
+  'CREATE TABLE {table} (anchor TEXT, cprob REAL, entity TEXT, info TEXT)'
+)
+INVERSE_TABLE_SQL = (
+  'CREATE TABLE {table} (entity TEXT, cprob REAL, anchor TEXT, info TEXT)'
+)
+FORWARD_INDEX_SQL = (
+  'CREATE INDEX {table}_anchor ON {table} (anchor COLLATE NOCASE)'
+)
+INVERSE_INDEX_SQL = 'CREATE INDEX {table}_entity ON {table} (entity)'
+FEATURES_TABLE_SQL = (
+  'CREATE TABLE {table} (anchor TEXT PRIMARY KEY, top_entities TEXT, '
+  'top_cprobs TEXT, top_nums TEXT, top1_top2_ratio REAL, entropy REAL, '
+  'total_count INTEGER, num_entities INTEGER)'
+)
+NORMALIZED_COLUMN_SQL = 'ALTER TABLE {table} ADD COLUMN norm_anchor TEXT'
+NORMALIZED_INDEX_SQL = (
+  'CREATE INDEX IF NOT EXISTS {table}_norm_anchor ON {table} (norm_anchor)'
+)
+
+def getSchema(connection, table):
+  """Gets the CREATE statements of a table and its indexes.
+
+  Returns: A (tableSql, indexSqls) tuple.
+  """
+  cursor = connection.cursor()
+  tableSql = cursor.execute(
+    'SELECT sql FROM sqlite_master WHERE type=\'table\' AND name=?',
+    (table,)
+  ).fetchone()[0]
+  indexSqls = [
+    row[0] for row in cursor.execute(
+      'SELECT sql FROM sqlite_master '
+      'WHERE type=\'index\' AND tbl_name=? AND sql IS NOT NULL',
+      (table,)
+    )
+  ]
+  return tableSql, indexSqls
+
+def createShardIndexes(shardPath, indexSqls):
+  connection = sqlite3.connect(shardPath)
+  for indexSql in indexSqls:
+    connection.execute(indexSql)
+  connection.commit()
+  connection.close()
+
+def buildShards(numShards, tables=TABLES):
+  """Splits the Crosswikis tables across numShards database files.
+
+  Each table is read in a single scan and its rows are routed to the shard of
+  their key. The indexes of the source table are then built on every shard in
+  parallel. The feature tables of the forward tables are split along with them,
+  if they've been built.
+
+  Args:
+    numShards: The number of shards to split the tables into.
+    tables: The tables to split.
+  """
+  constants.CROSSWIKIS_NUM_SHARDS = numShards
+  shardPaths = crosswikis.getDbPaths()
+  source = sqlite3.connect(constants.CROSSWIKIS_DB_PATH)
+  shards = [sqlite3.connect(shardPath) for shardPath in shardPaths]
+  sourceTables = set([
+    row[0] for row in
+    source.execute('SELECT name FROM sqlite_master WHERE type=\'table\'')
+  ])
+  featuresTables = [
+    crosswikis.getFeaturesTable(table) for table in tables
+    if table in FORWARD_TABLES
+      and crosswikis.getFeaturesTable(table) in sourceTables
+  ]
+
+  for table in tables + featuresTables:
+    print('Sharding {}'.format(table))
+    tableSql, indexSqls = getSchema(source, table)
+    for shard in shards:
+      shard.execute('DROP TABLE IF EXISTS {table}'.format(table=table))
+      shard.execute(tableSql)
+
+    cursor = source.cursor()
+    cursor.execute('SELECT * FROM {table}'.format(table=table))
+    columns = [description[0] for description in cursor.description]
+    keyIndex = columns.index(crosswikis.getShardKeyColumn(table))
+    insertString = 'INSERT INTO {table} VALUES ({params})'.format(
+      table=table,
+      params=', '.join(['?'] * len(columns))
+    )
+    batches = [[] for shard in shards]
+    for row in cursor:
+      batch = batches[crosswikis.getShard(row[keyIndex])]
+      batch.append(row)
+      if len(batch) >= INSERT_BATCH_SIZE:
+        shards[crosswikis.getShard(row[keyIndex])].executemany(insertString,
+          batch)
+        batch.clear()
+    for shard, batch in zip(shards, batches):
+      shard.executemany(insertString, batch)
+      shard.commit()
+
+    print('Indexing {}'.format(table))
+    with concurrent.futures.ProcessPoolExecutor(numShards) as executor:
+      list(executor.map(createShardIndexes, shardPaths,
+        [indexSqls] * numShards))
+
+  for shard in shards:
+    shard.close()
+  source.close()
+
+def insertRows(connection, table, rows):
+  """Inserts an iterable of rows into a table in batches."""
+  rows = iter(rows)
+  batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+  while len(batch) > 0:
+    connection.executemany(
+      'INSERT INTO {table} VALUES ({params})'.format(
+        table=table,
+        params=', '.join(['?'] * len(batch[0]))
+      ),
+      batch
+    )
+    batch = list(itertools.islice(rows, INSERT_BATCH_SIZE))
+
+def getNumerators(info):
+  """Gets the numerator of each label in an info string.
+
+  Returns: A list with the numerator of each label in LABELS, or None for labels
+    that aren't in the info string.
+  """
+  labelCounts = crosswikis.getLabelCounts(info)
+  return [
+    labelCounts[label][0] if label in labelCounts else None
+    for label in LABELS
+  ]
+
+def sumNumerators(infos):
+  """Adds up the numerators of each label in several info strings.
+
+  Returns: A list like getNumerators() returns.
+  """
+  numerators = [None] * len(LABELS)
+  for info in infos:
+    for i, num in enumerate(getNumerators(info)):
+      if num is not None:
+        numerators[i] = (numerators[i] or 0) + num
+  return numerators
+
+def parseForwardRow(row):
+  """Parses a row of the raw forward dump into the form dict-to-tab.sh loads.
+
+  Returns: An (anchor, cprob, entity, info) tuple, where info keeps the leading
+    space the importer leaves on it.
+  """
+  anchor, cprob, entity, info = crosswikis.parseRawCrosswikisRow(row)
+  return anchor, cprob, entity, ' ' + info if info != '' else info
+
+def deriveInverseRows(entity, anchorNumerators):
+  """Computes the inverse rows of one entity from its forward numerators.
+
+  Args:
+    entity: The entity.
+    anchorNumerators: A list of (anchor, numerators) tuples for every anchor
+      linked to the entity, where numerators is from getNumerators().
+
+  Returns: A list of (entity, cprob, anchor, info) rows, where cprob is
+    p(anchor|entity) and the info string's denominators are the entity's totals
+    for each label.
+  """
+  totals = [
+    sum([numerators[i] or 0 for (anchor, numerators) in anchorNumerators])
+    for i in range(len(LABELS))
+  ]
+  total = sum(totals)
+  rows = []
+  for anchor, numerators in anchorNumerators:
+    labelCounts = {
+      label: (num, labelTotal)
+      for (label, num, labelTotal) in zip(LABELS, numerators, totals)
+      if num is not None
+    }
+    num = sum([num or 0 for num in numerators])
+    cprob = num / total if total != 0 else 0
+    rows.append(
+      (entity, cprob, anchor, crosswikis.formatLabelCounts(labelCounts))
+    )
+  return rows
+
+def buildFromForwardDump(dumpPath=FORWARD_DUMP_PATH, table='crosswikis',
+    invTable='crosswikis_inv'):
+  """Loads the forward table from a dump and derives the inverse table.
+
+  The forward rows are loaded the way dict-to-tab.sh loads them, with the
+  indexed norm_anchor column addNormalizedKeys() adds.
+
+  Args:
+    dumpPath: The path of the raw forward dictionary dump.
+    table: The forward table to create.
+    invTable: The inverse table to create.
+  """
+  connection = sqlite3.connect(constants.CROSSWIKIS_DB_PATH)
+  for tableName, tableSql in [(table, FORWARD_TABLE_SQL),
+      (invTable, INVERSE_TABLE_SQL)]:
+    connection.execute('DROP TABLE IF EXISTS {table}'.format(table=tableName))
+    connection.execute(tableSql.format(table=tableName))
+  connection.execute(NORMALIZED_COLUMN_SQL.format(table=table))
+  runDir = tempfile.mkdtemp(dir=os.path.dirname(constants.CROSSWIKIS_DB_PATH))
+
+  # Load the forward rows, and sort their (entity, anchor, numerators) by
+  # entity on the way through.
+  forwardRows = []
+  def iterInverseLines():
+    with open(dumpPath) as dumpFile:
+      for row in dumpFile:
+        anchor, cprob, entity, info = parseForwardRow(row)
+        forwardRows.append((anchor, float(cprob), entity, info,
+          crosswikis.normalizeString(anchor)))
+        if len(forwardRows) >= INSERT_BATCH_SIZE:
+          insertRows(connection, table, forwardRows)
+          forwardRows.clear()
+        numerators = ['' if num is None else str(num)
+          for num in getNumerators(info)]
+        yield '\t'.join([entity, anchor] + numerators)
+  print('Loading {}'.format(table))
+  runPaths = myutils.sortWithSpill(iterInverseLines(), runDir, SPILL_MAX_LINES)
+  insertRows(connection, table, forwardRows)
+
+  print('Deriving {}'.format(invTable))
+  lines = (line.split('\t') for line in myutils.mergeSortedLines(runPaths))
+  def iterInverseRows():
+    for entity, group in itertools.groupby(lines, key=lambda parts: parts[0]):
+      anchorNumerators = [
+        (parts[1], [int(num) if num != '' else None for num in parts[2:]])
+        for parts in group
+      ]
+      yield from deriveInverseRows(entity, anchorNumerators)
+  insertRows(connection, invTable, iterInverseRows())
+  shutil.rmtree(runDir)
+
+  print('Indexing')
+  connection.execute(FORWARD_INDEX_SQL.format(table=table))
+  connection.execute(NORMALIZED_INDEX_SQL.format(table=table))
+  connection.execute(INVERSE_INDEX_SQL.format(table=invTable))
+  connection.commit()
+  connection.close()
+
+def iterPairNumerators(connection, table):
+  """Yields ((entity, anchor), numerators) for every pair in a table, in order.
+
+  Numerators of duplicate rows for a pair are added up.
+  """
+  rows = connection.execute(
+    'SELECT entity, anchor, info FROM {table} ORDER BY entity, anchor'.format(
+      table=table
+    )
+  )
+  pairRows = itertools.groupby(rows, key=lambda row: (row[0], row[1]))
+  for pair, group in pairRows:
+    yield pair, sumNumerators([info for (entity, anchor, info) in group])
+
+def checkConsistency(table='crosswikis', invTable='crosswikis_inv',
+    maxReported=20):
+  """Checks that the forward and inverse tables have the same numerators.
+
+  Every (entity, anchor) pair must be in both tables, with the same numerator
+  for each label.
+
+  Args:
+    table: The forward table.
+    invTable: The inverse table.
+    maxReported: The most mismatches to print.
+
+  Returns: The number of mismatched pairs.
+  """
+  connection = sqlite3.connect(constants.CROSSWIKIS_DB_PATH)
+  forward = iterPairNumerators(connection, table)
+  inverse = iterPairNumerators(connection, invTable)
+  numMismatches = 0
+  def report(message):
+    nonlocal numMismatches
+    numMismatches += 1
+    if numMismatches <= maxReported:
+      print(message)
+
+  forwardItem = next(forward, None)
+  inverseItem = next(inverse, None)
+  while forwardItem is not None or inverseItem is not None:
+    if inverseItem is None or (forwardItem is not None
+        and forwardItem[0] < inverseItem[0]):
+      report('Only in {}: {}'.format(table, forwardItem[0]))
+      forwardItem = next(forward, None)
+    elif forwardItem is None or inverseItem[0] < forwardItem[0]:
+      report('Only in {}: {}'.format(invTable, inverseItem[0]))
+      inverseItem = next(inverse, None)
+    else:
+      if forwardItem[1] != inverseItem[1]:
+        report('Numerators differ for {}: {} vs. {}'.format(
+          forwardItem[0], forwardItem[1], inverseItem[1]))
+      forwardItem = next(forward, None)
+      inverseItem = next(inverse, None)
+  connection.close()
+  print('{} mismatched pairs.'.format(numMismatches))
+  return numMismatches
+
+def addNormalizedKeysToDb(dbPath, tables):
+  connection = sqlite3.connect(dbPath)
+  connection.create_function('normalize', 1, crosswikis.normalizeString,
+    deterministic=True)
+  for table in tables:
+    columns = [
+      row[1] for row in
+      connection.execute('PRAGMA table_info({table})'.format(table=table))
+    ]
+    if 'norm_anchor' not in columns:
+      connection.execute(NORMALIZED_COLUMN_SQL.format(table=table))
+    connection.execute(
+      'UPDATE {table} SET norm_anchor=normalize(anchor)'.format(table=table)
+    )
+    connection.execute(NORMALIZED_INDEX_SQL.format(table=table))
+  connection.commit()
+  connection.close()
+
+def addNormalizedKeys(tables=FORWARD_TABLES):
+  """Adds the indexed norm_anchor column to the forward tables.
+
+  If the database is sharded, every shard is updated in parallel.
+
+  Args:
+    tables: The forward tables to add the column to.
+  """
+  dbPaths = crosswikis.getDbPaths()
+  with concurrent.futures.ProcessPoolExecutor(len(dbPaths)) as executor:
+    list(executor.map(addNormalizedKeysToDb, dbPaths,
+      [tables] * len(dbPaths)))
+
+def getFeatureRow(anchor, entityDistribution, k):
+  """Computes the feature table row of an anchor.
+
+  Args:
+    anchor: The case-folded anchor.
+    entityDistribution: The anchor's list of (entity, cprob, num, denom) tuples,
+      from crosswikis.getEntityDistribution().
+    k: The number of top entities to keep.
+
+  Returns: A row for FEATURES_TABLE_SQL.
+  """
+  cprobs = [cprob for (entity, cprob, num, denom) in entityDistribution]
+  nums = [num for (entity, cprob, num, denom) in entityDistribution]
+  totalCount = entityDistribution[0][3]
+  top1Top2Ratio = None
+  if len(cprobs) > 1:
+    top1Top2Ratio = cprobs[0] / cprobs[1] if cprobs[1] != 0 else math.inf
+  entropy = 0.0
+  for num in nums:
+    if num > 0:
+      share = num / totalCount
+      entropy -= share * math.log2(share)
+  topEntities = entityDistribution[:k]
+  return (
+    anchor,
+    '\t'.join([entity for (entity, cprob, num, denom) in topEntities]),
+    '\t'.join([repr(cprob) for (entity, cprob, num, denom) in topEntities]),
+    '\t'.join([str(num) for (entity, cprob, num, denom) in topEntities]),
+    top1Top2Ratio,
+    entropy,
+    totalCount,
+    len(entityDistribution),
+  )
+
+def writeRangeFeatures(table, lowAnchor, highAnchor, runDir, k):
+  """Computes the feature rows of a range of anchors and writes them to a file.
+
+  Returns: The path of the file, with one row per line, encoded as JSON.
+  """
+  runFd, runPath = tempfile.mkstemp(suffix='.features', dir=runDir)
+  distributions = crosswikis.iterAnchorDistributions(table, lowAnchor,
+    highAnchor, asciiFolded=True)
+  with os.fdopen(runFd, 'w') as runFile:
+    for anchor, entityDistribution in distributions:
+      print(json.dumps(getFeatureRow(anchor, entityDistribution, k)),
+        file=runFile)
+  return runPath
+
+def buildFeatures(tables=FORWARD_TABLES, k=FEATURES_TOP_K, numWorkers=1):
+  """Builds the anchor feature table of each forward table.
+
+  Each table is scanned once, split into anchor ranges that are processed in
+  parallel, and the rows are stored in the database shard of their anchor.
+
+  Args:
+    tables: The forward tables to build feature tables for.
+    k: The number of top entities to keep for each anchor.
+    numWorkers: The number of processes to scan each table with.
+  """
+  runDir = tempfile.mkdtemp(dir=os.path.dirname(constants.CROSSWIKIS_DB_PATH))
+  for table in tables:
+    featuresTable = crosswikis.getFeaturesTable(table)
+    print('Building {}'.format(featuresTable))
+    rangeArgs = [
+      (table, lowAnchor, highAnchor, runDir, k)
+      for (lowAnchor, highAnchor) in
+      crosswikis.getAnchorShardBounds(table, numWorkers)
+    ]
+    if numWorkers > 1:
+      with multiprocessing.Pool(numWorkers) as pool:
+        runPaths = pool.starmap(writeRangeFeatures, rangeArgs)
+    else:
+      runPaths = [writeRangeFeatures(*args) for args in rangeArgs]
+
+    dbPaths = crosswikis.getDbPaths()
+    connections = [sqlite3.connect(dbPath) for dbPath in dbPaths]
+    for connection in connections:
+      connection.execute('DROP TABLE IF EXISTS {table}'.format(
+        table=featuresTable))
+      connection.execute(FEATURES_TABLE_SQL.format(table=featuresTable))
+    batches = [[] for connection in connections]
+    for runPath in runPaths:
+      with open(runPath) as runFile:
+        for line in runFile:
+          row = tuple(json.loads(line))
+          shard = dbPaths.index(crosswikis.getKeyDbPath(row[0]))
+          batches[shard].append(row)
+          if len(batches[shard]) >= INSERT_BATCH_SIZE:
+            insertRows(connections[shard], featuresTable, batches[shard])
+            batches[shard].clear()
+      os.remove(runPath)
+    for connection, batch in zip(connections, batches):
+      insertRows(connection, featuresTable, batch)
+      connection.commit()
+      connection.close()
+  shutil.rmtree(runDir)
+  crosswikis.forgetTables()
+
+def updateFeatures(table, anchors, k=FEATURES_TOP_K):
+  """Computes the feature rows of some anchors again, if the feature table
+  has been built.
+
+  Args:
+    table: The forward table whose feature table to update.
+    anchors: The anchors whose entity distributions changed.
+    k: The number of top entities the feature table was built with.
+  """
+  featuresTable = crosswikis.getFeaturesTable(table)
+  if not crosswikis.hasTable(featuresTable):
+    return
+  keys = set([
+    anchor.translate(crosswikis.ASCII_CASE_FOLD) for anchor in anchors
+  ])
+  shardRows = {}
+  for key in keys:
+    dbPath = crosswikis.getKeyDbPath(key)
+    entityDistribution = crosswikis.getEntityDistribution(key, table=table)
+    rows = shardRows.setdefault(dbPath, ([], []))
+    rows[0].append((key,))
+    if len(entityDistribution) > 0:
+      rows[1].append(getFeatureRow(key, entityDistribution, k))
+  for dbPath, (deletedKeys, rows) in shardRows.items():
+    connection = sqlite3.connect(dbPath)
+    connection.executemany(
+      'DELETE FROM {table} WHERE anchor=?'.format(table=featuresTable),
+      deletedKeys
+    )
+    insertRows(connection, featuresTable, rows)
+    connection.commit()
+    connection.close()
+  print('Updated {} anchors in {}'.format(len(keys), featuresTable))
+
+def iterDistinctKeys(table, column):
+  """Yields the distinct values of a column of a table in every shard."""
+  queryString = 'SELECT DISTINCT {column} FROM {table}'.format(
+    table=table,
+    column=column
+  )
+  for dbPath in crosswikis.getDbPaths():
+    for row in crosswikis.queryDb(dbPath, queryString, ()):
+      yield row[0]
+
+def buildBloomFilter(path, column, foldKey, fpRate, tables):
+  """Builds a Bloom filter over the values of a column in several tables.
+
+  Args:
+    path: The path to write the filter to.
+    column: The column to take the keys from.
+    foldKey: A function applied to each value to get its key.
+    fpRate: The target false positive rate.
+    tables: The tables to take the keys from.
+  """
+  # The filter is sized for an upper bound on the number of keys, since values
+  # can be repeated across tables and shards and fold to the same key.
+  countString = 'SELECT COUNT(DISTINCT {column}) FROM {table}'
+  numKeys = sum([
+    row[0]
+    for table in tables
+    for row in crosswikis.query(
+      countString.format(table=table, column=column), ()
+    )
+  ])
+  bloomFilter = bloom.newFilter(numKeys, fpRate)
+  for table in tables:
+    for value in iterDistinctKeys(table, column):
+      key = foldKey(value)
+      if not bloom.mightContain(bloomFilter, key):
+        bloom.addKey(bloomFilter, key)
+  bloom.saveFilter(bloomFilter, path)
+  print('{}: {}'.format(path, bloom.formatStats(bloomFilter)))
+
+def buildBloomFilters(fpRate=constants.BLOOM_FP_RATE,
+    tables=['crosswikis', 'crosswikis_inv']):
+  """Builds the anchor and entity Bloom filters.
+
+  The subset tables only have rows from the full tables, so the filters over the
+  full tables cover them too.
+
+  Args:
+    fpRate: The target false positive rate of each filter.
+    tables: The tables to take the anchors and entities from.
+  """
+  buildBloomFilter(constants.ANCHOR_BLOOM_PATH, 'anchor',
+    lambda anchor: anchor.translate(crosswikis.ASCII_CASE_FOLD), fpRate, tables)
+  buildBloomFilter(constants.ENTITY_BLOOM_PATH, 'entity',
+    lambda entity: entity, fpRate, tables)
+
+def buildIdMaps(table='crosswikis'):
+  """Adds the entities and anchors of a table to the persisted ID maps."""
+  entityIds, anchorIds = ids.loadIdMaps()
+  queryString = 'SELECT anchor, entity FROM {table}'.format(table=table)
+  ids.buildIdMaps(crosswikis.query(queryString, ()), entityIds, anchorIds)
+  ids.saveIdMaps(entityIds, anchorIds)
+  print('{} entities and {} anchors have IDs.'.format(
+    len(entityIds[1]), len(anchorIds[1])))
+
+def main():
+  """Usage:
+    python build_crosswikis.py shard {numShards}
+    python build_crosswikis.py forward [{dumpPath}]
+    python build_crosswikis.py check
+    python build_crosswikis.py normalize
+    python build_crosswikis.py bloom [{fpRate}]
+    python build_crosswikis.py features [{numWorkers}]
+    python build_crosswikis.py ids
+  """
+  command = sys.argv[1]
+  if command == 'shard':
+    buildShards(int(sys.argv[2]))
+  elif command == 'forward':
+    buildFromForwardDump(*sys.argv[2:3])
+    checkConsistency()
+  elif command == 'check':
+    checkConsistency()
+  elif command == 'normalize':
+    addNormalizedKeys()
+  elif command == 'features':
+    buildFeatures(numWorkers=int(sys.argv[2]) if len(sys.argv) > 2 else 1)
+  elif command == 'bloom':
+    buildBloomFilters(*[float(fpRate) for fpRate in sys.argv[2:3]])
+  elif command == 'ids':
+    buildIdMaps()
+  else:
+    print(main.__doc__)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,413 @@
+# Exports the Crosswikis tables to partitioned columnar files, and scans them
+# with vectorized filters and aggregates, for corpus-wide questions that would
+# otherwise be ad-hoc SQL scans over the row-oriented tables.
+#
+# Each table is written under COLUMNS_PATH/{table}/ with parsed label counts.
+# Rows are partitioned by a hash of their case-folded key (the anchor of forward
+# tables and the entity of inverse tables, as in crosswikis.getShard()), and
+# each partition is made of row groups with one .npy file per column. Strings
+# are stored as a UTF-8 byte array and an array of offsets into it. A
+# manifest.json lists the columns and the row groups, with the min and max of
+# every numeric column in each, so predicates can skip whole row groups.
+#
+# Rows are exported as they are in the tables, so anchors that only differ in
+# case are separate rows, and predicates apply to each of them rather than to
+# the aggregated links of crosswikis.aggregateResults(). The folded_anchor
+# column holds the lower-cased anchor, which is what the rest of the pipeline
+# counts as an anchor.
+#
+# Scans only load the columns they need, memory-mapped, and filter them in
+# batches. String columns are gathered into NumPy bytes arrays without decoding
+# them. Aggregates run one process per core over the partitions. For example,
+# the number of anchors (ignoring case) with a table row with cprob > 0.9 and
+# count > 1000:
+#
+#   aggregate('crosswikis', [('anchors', 'countDistinct', 'folded_anchor')],
+#     [('cprob', '>', 0.9), ('num', '>', 1000)])
+#
+# Usage:
+#   python column_store.py export [{table} ...]
+
+import constants
+import crosswikis
+import json
+import multiprocessing
+import numpy as np
+import os
+import shutil
+import sqlite3
+import sys
+import zlib
+
+COLUMNS_PATH = constants.DATA_PATH + 'google-crosswikis/columns/'
+
+TABLES = ['crosswikis', 'crosswikis_inv']
+
+NUM_PARTITIONS = 64
+
+# The most rows in a row group, and in a batch of a scan.
+ROW_GROUP_SIZE = 1000000
+BATCH_SIZE = 65536
+
+LABELS = ['W:', 'Wx:', 'w:', 'w\':']
+
+# The numerator and denominator columns of each label. Labels that aren't in a
+# row's info string are MISSING.
+LABEL_COLUMNS = [
+  '{}_{}'.format(label.rstrip(':').replace('\'', 'p'), part)
+  for label in LABELS
+  for part in ['num', 'denom']
+]
+MISSING = -1
+
+# The columns of every table, and their types. folded_anchor is the lower-cased
+# anchor and num is the sum of the label numerators, like in
+# crosswikis.aggregateResults().
+COLUMN_TYPES = dict(
+  [('anchor', 'string'), ('folded_anchor', 'string'), ('entity', 'string'),
+    ('cprob', 'float64'), ('num', 'int64')]
+  + [(column, 'int64') for column in LABEL_COLUMNS]
+)
+
+OPERATORS = {
+  '<': np.less,
+  '<=': np.less_equal,
+  '>': np.greater,
+  '>=': np.greater_equal,
+  '==': np.equal,
+  '!=': np.not_equal,
+}
+
+def getPartition(key, numPartitions):
+  """Gets the partition of a key, ignoring its case."""
+  return zlib.crc32(key.lower().encode('utf-8')) % numPartitions
+
+def getTableDir(table):
+  return COLUMNS_PATH + table + '/'
+
+def parseRow(anchor, entity, cprob, info):
+  """Turns a table row into a list of values in the order of COLUMN_TYPES."""
+  labelCounts = crosswikis.getLabelCounts(info)
+  labelValues = []
+  for label in LABELS:
+    labelValues.extend(labelCounts.get(label, (MISSING, MISSING)))
+  num = sum([num for (num, denom) in labelCounts.values()])
+  return [anchor, anchor.lower(), entity, cprob, num] + labelValues
+
+def writeRowGroup(groupDir, rows):
+  """Writes rows from parseRow() to a row group directory.
+
+  Returns: A dict with the min and max of each numeric column.
+  """
+  os.makedirs(groupDir)
+  stats = {}
+  for column, values in zip(COLUMN_TYPES, zip(*rows)):
+    if COLUMN_TYPES[column] == 'string':
+      encoded = [value.encode('utf-8') for value in values]
+      offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+      np.cumsum([len(value) for value in encoded], out=offsets[1:])
+      data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+      np.save(groupDir + column + '.data.npy', data)
+      np.save(groupDir + column + '.offsets.npy', offsets)
+    else:
+      array = np.array(values, dtype=COLUMN_TYPES[column])
+      np.save(groupDir + column + '.npy', array)
+      stats[column] = [array.min().item(), array.max().item()]
+  return stats
+
+def getRowidRanges(dbPath, table, numRanges):
+  """Splits the rowids of a table into up to numRanges [low, high) ranges."""
+  connection = sqlite3.connect(dbPath)
+  low, high = connection.execute(
+    'SELECT MIN(rowid), MAX(rowid) FROM {table}'.format(table=table)
+  ).fetchone()
+  connection.close()
+  if low is None:
+    return []
+  size = max(1, -(-(high + 1 - low) // numRanges))
+  return [(start, start + size) for start in range(low, high + 1, size)]
+
+def exportRange(table, dbPath, lowRowid, highRowid, taskId, numPartitions):
+  """Exports a range of rowids of a table to row groups in every partition.
+
+  Returns: A list of the manifest entries of the row groups that were written.
+  """
+  tableDir = getTableDir(table)
+  queryString = (
+    'SELECT anchor, entity, cprob, info FROM {table} '
+    'WHERE rowid >= ? AND rowid < ?'
+  ).format(table=table)
+  keyIndex = 0 if crosswikis.getShardKeyColumn(table) == 'anchor' else 2
+  buffers = [[] for partition in range(numPartitions)]
+  rowGroups = []
+  def flush(partition):
+    path = 'part-{:04d}/t{:04d}-g{:05d}/'.format(partition, taskId,
+      len(rowGroups))
+    stats = writeRowGroup(tableDir + path, buffers[partition])
+    rowGroups.append({
+      'partition': partition,
+      'path': path,
+      'numRows': len(buffers[partition]),
+      'stats': stats,
+    })
+    buffers[partition].clear()
+
+  for anchor, entity, cprob, info in crosswikis.queryDb(dbPath, queryString,
+      (lowRowid, highRowid)):
+    row = parseRow(anchor, entity, cprob, info)
+    partition = getPartition(row[keyIndex], numPartitions)
+    buffers[partition].append(row)
+    if len(buffers[partition]) >= ROW_GROUP_SIZE:
+      flush(partition)
+  for partition in range(numPartitions):
+    if len(buffers[partition]) > 0:
+      flush(partition)
+  return rowGroups
+
+def exportTable(table, numPartitions=NUM_PARTITIONS, numWorkers=None):
+  """Exports a table, from every database shard, to columnar files.
+
+  Args:
+    table: The table to export.
+    numPartitions: The number of partitions to hash the rows into.
+    numWorkers: The number of processes to export with. Defaults to the number
+      of cores.
+  """
+  numWorkers = numWorkers or os.cpu_count()
+  tableDir = getTableDir(table)
+  shutil.rmtree(tableDir, ignore_errors=True)
+  os.makedirs(tableDir)
+  rangeArgs = [
+    (dbPath, lowRowid, highRowid)
+    for dbPath in crosswikis.getDbPaths()
+    for (lowRowid, highRowid) in getRowidRanges(dbPath, table, numWorkers)
+  ]
+  exportArgs = [
+    (table, dbPath, lowRowid, highRowid, taskId, numPartitions)
+    for taskId, (dbPath, lowRowid, highRowid) in enumerate(rangeArgs)
+  ]
+  print('Exporting {}'.format(table))
+  with multiprocessing.Pool(numWorkers) as pool:
+    rowGroupLists = pool.starmap(exportRange, exportArgs)
+
+  manifest = {
+    'table': table,
+    'numPartitions': numPartitions,
+    'columns': COLUMN_TYPES,
+    'rowGroups': sorted(
+      [rowGroup for rowGroups in rowGroupLists for rowGroup in rowGroups],
+      key=lambda rowGroup: rowGroup['path']
+    ),
+  }
+  with open(tableDir + 'manifest.json', 'w') as manifestFile:
+    json.dump(manifest, manifestFile, indent=2)
+
+def readManifest(table):
+  with open(getTableDir(table) + 'manifest.json') as manifestFile:
+    return json.load(manifestFile)
+
+def mightMatch(stats, predicates):
+  """Checks a row group's min and max against the predicates.
+
+  Returns: False if no row in the row group can match every predicate.
+  """
+  for column, operator, value in predicates:
+    low, high = stats[column]
+    if ((operator == '<' and low >= value)
+        or (operator == '<=' and low > value)
+        or (operator == '>' and high <= value)
+        or (operator == '>=' and high < value)
+        or (operator == '==' and not low <= value <= high)
+        or (operator == '!=' and low == high == value)):
+      return False
+  return True
+
+def loadColumn(groupDir, column, columnType):
+  """Memory-maps a column of a row group.
+
+  Returns: The array of a numeric column, or a (data, offsets) tuple for a
+    string column.
+  """
+  if columnType == 'string':
+    return (
+      np.load(groupDir + column + '.data.npy', mmap_mode='r'),
+      np.load(groupDir + column + '.offsets.npy', mmap_mode='r'),
+    )
+  return np.load(groupDir + column + '.npy', mmap_mode='r')
+
+def gatherStrings(data, offsets, indices):
+  """Gathers the strings at some indices of a string column.
+
+  Returns: A NumPy bytes array of the UTF-8 encoded strings. Use
+    np.char.decode() to turn it into strs.
+  """
+  starts = np.asarray(offsets[indices])
+  lengths = np.asarray(offsets[indices + 1]) - starts
+  width = max(1, int(lengths.max())) if len(indices) > 0 else 1
+  positions = np.arange(width)
+  inString = positions < lengths[:, np.newaxis]
+  chars = np.zeros((len(indices), width), dtype=np.uint8)
+  chars[inString] = data[(starts[:, np.newaxis] + positions)[inString]]
+  return chars.view('S{}'.format(width)).ravel()
+
+def iterRowGroupBatches(table, columnTypes, rowGroup, columns, predicates):
+  """Yields the rows of a row group that match the predicates, in batches.
+
+  Yields: (numRows, batch) tuples, where batch is a dict mapping each of the
+    columns to an array of its values.
+  """
+  for column, operator, value in predicates:
+    if columnTypes[column] == 'string':
+      raise ValueError('Predicates on string columns aren\'t supported.')
+  if not mightMatch(rowGroup['stats'], predicates):
+    return
+  groupDir = getTableDir(table) + rowGroup['path']
+  neededColumns = set(columns) | set([column for (column, o, v) in predicates])
+  arrays = dict([
+    (column, loadColumn(groupDir, column, columnTypes[column]))
+    for column in neededColumns
+  ])
+  for start in range(0, rowGroup['numRows'], BATCH_SIZE):
+    end = min(start + BATCH_SIZE, rowGroup['numRows'])
+    mask = np.ones(end - start, dtype=bool)
+    for column, operator, value in predicates:
+      mask &= OPERATORS[operator](arrays[column][start:end], value)
+    indices = np.flatnonzero(mask) + start
+    if len(indices) == 0:
+      continue
+    batch = {}
+    for column in columns:
+      if columnTypes[column] == 'string':
+        batch[column] = gatherStrings(*arrays[column], indices)
+      else:
+        batch[column] = np.asarray(arrays[column][indices])
+    yield len(indices), batch
+
+def scan(table, columns, predicates=[]):
+  """Scans the exported table for the rows that match every predicate.
+
+  Args:
+    table: The exported table.
+    columns: The columns to read.
+    predicates: A list of (column, operator, value) tuples on numeric columns,
+      where operator is a key of OPERATORS.
+
+  Yields: Dicts mapping each of the columns to an array of its values in a batch
+    of matching rows. String columns are bytes arrays from gatherStrings().
+  """
+  manifest = readManifest(table)
+  for rowGroup in manifest['rowGroups']:
+    batches = iterRowGroupBatches(table, manifest['columns'], rowGroup,
+      columns, predicates)
+    for numRows, batch in batches:
+      yield batch
+
+def aggregatePartition(table, columnTypes, rowGroups, aggregates,
+    predicates):
+  """Computes partial aggregates over the row groups of one partition.
+
+  Returns: A list with the partial value of each aggregate.
+  """
+  keyColumn = crosswikis.getShardKeyColumn(table)
+  columns = set([
+    aggregate[2] for aggregate in aggregates if aggregate[2] is not None
+  ])
+  partials = [None] * len(aggregates)
+  for rowGroup in rowGroups:
+    batches = iterRowGroupBatches(table, columnTypes, rowGroup, columns,
+      predicates)
+    for numRows, batch in batches:
+      for i, aggregate in enumerate(aggregates):
+        name, function, column = aggregate[:3]
+        if function == 'count':
+          value = numRows
+        elif function == 'sum':
+          value = batch[column].sum().item()
+        elif function == 'min':
+          value = batch[column].min().item()
+        elif function == 'max':
+          value = batch[column].max().item()
+        elif function == 'countDistinct':
+          value = np.unique(batch[column])
+        elif function == 'histogram':
+          value = np.histogram(batch[column], bins=aggregate[3])[0]
+        partials[i] = combinePartials(function, partials[i], value)
+  # Rows with the same key are all in one partition, so distinct keys can be
+  # counted per partition.
+  partitionColumns = [keyColumn]
+  if keyColumn == 'anchor':
+    partitionColumns.append('folded_anchor')
+  for i, aggregate in enumerate(aggregates):
+    if aggregate[1] == 'countDistinct' and aggregate[2] in partitionColumns:
+      partials[i] = len(partials[i]) if partials[i] is not None else 0
+  return partials
+
+def combinePartials(function, partial, value):
+  """Combines two partial values of an aggregate function."""
+  if partial is None:
+    return value
+  if value is None:
+    return partial
+  if function == 'min':
+    return min(partial, value)
+  if function == 'max':
+    return max(partial, value)
+  if function == 'countDistinct' and isinstance(partial, np.ndarray):
+    return np.union1d(partial, value)
+  return partial + value
+
+def aggregate(table, aggregates, predicates=[], numWorkers=None):
+  """Computes aggregates over the rows of an exported table that match every
+  predicate, with one process per partition.
+
+  Args:
+    table: The exported table.
+    aggregates: A list of (name, function, column) tuples, where function is
+      one of count (column is ignored), sum, min, max or countDistinct, or
+      (name, 'histogram', column, binEdges) tuples.
+    predicates: A list of (column, operator, value) tuples, as for scan().
+    numWorkers: The number of processes to use. Defaults to the number of
+      cores.
+
+  Returns: A dict mapping the name of each aggregate to its value. min and max
+    are None if no rows match.
+  """
+  numWorkers = numWorkers or os.cpu_count()
+  manifest = readManifest(table)
+  partitionRowGroups = {}
+  for rowGroup in manifest['rowGroups']:
+    partitionRowGroups.setdefault(rowGroup['partition'], []).append(rowGroup)
+  partitionArgs = [
+    (table, manifest['columns'], rowGroups, aggregates, predicates)
+    for rowGroups in partitionRowGroups.values()
+  ]
+  with multiprocessing.Pool(numWorkers) as pool:
+    partialLists = pool.starmap(aggregatePartition, partitionArgs)
+
+  results = {}
+  for i, aggregate in enumerate(aggregates):
+    name, function = aggregate[:2]
+    value = None
+    for partials in partialLists:
+      value = combinePartials(function, value, partials[i])
+    if function == 'countDistinct' and isinstance(value, np.ndarray):
+      value = len(value)
+    if value is None and function in ['count', 'sum', 'countDistinct']:
+      value = 0
+    if value is None and function == 'histogram':
+      value = np.zeros(len(aggregate[3]) - 1, dtype=np.int64)
+    results[name] = value
+  return results
+
+def main():
+  """Usage:
+    python column_store.py export [{table} ...]
+  """
+  if len(sys.argv) > 1 and sys.argv[1] == 'export':
+    for table in sys.argv[2:] or TABLES:
+      exportTable(table)
+  else:
+    print(main.__doc__)
+
+if __name__ == '__main__':
+  main()
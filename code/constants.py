@@ -2,5 +2,17 @@ PROJECT_PATH = '/home/jstn/research/knowitall/synonym-data-eval/'
 DATA_PATH = PROJECT_PATH + 'data/'
 RESULTS_PATH = PROJECT_PATH + 'results/'
 CROSSWIKIS_DB_PATH = DATA_PATH + 'google-crosswikis/crosswikis.db'
+# The number of hash-partitioned shards the Crosswikis tables are split across,
+# built with build_crosswikis.py. 0 uses CROSSWIKIS_DB_PATH directly.
+CROSSWIKIS_NUM_SHARDS = 0
+CROSSWIKIS_SHARD_PATH = DATA_PATH + 'google-crosswikis/crosswikis-{shard}.db'
+# Bloom filters over the Crosswikis anchors and entities, built with
+# build_crosswikis.py, and their target false positive rate.
+ANCHOR_BLOOM_PATH = DATA_PATH + 'google-crosswikis/anchors.bloom'
+ENTITY_BLOOM_PATH = DATA_PATH + 'google-crosswikis/entities.bloom'
+BLOOM_FP_RATE = 0.01
+# A local dump of Open IE extractions, one per line, with tab-separated fields
+# starting with arg1, rel and arg2.
+OPENIE_EXTRACTIONS_PATH = DATA_PATH + 'openie-extractions'
 OPENIE_BACKEND_JAR_PATH = ('/home/jstn/research/knowitall/openie-backend/'
   'target/openiedemo-backend-1.0.2-SNAPSHOT-jar-with-dependencies.jar')
@@ -1,7 +1,74 @@
+import bloom
+import concurrent.futures
 import constants
+import heapq
+import itertools
 import myutils
+import numpy as np
+import os
+import queue
 import re
 import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+# Set by long-running processes, like link_service.py, to keep database
+# connections and shard threads open between queries. Connections are kept per
+# thread, so don't set this before forking worker processes.
+KEEP_CONNECTIONS_OPEN = False
+_threadState = threading.local()
+_shardExecutor = None
+_bloomFilters = {}
+_bloomLock = threading.Lock()
+_hasTable = {}
+
+# The most strings to look up in one query in getEntityDistributions(). SQLite
+# limits the number of parameters in a query.
+MAX_BATCH_SIZE = 500
+
+# The number of rows to fetch from a cursor at a time.
+FETCH_BATCH_SIZE = 1000
+
+# The most batches of FETCH_BATCH_SIZE rows each shard reads ahead of the caller
+# in a query() sent to every shard.
+SHARD_QUEUE_SIZE = 8
+
+# aggregateResults() groups results with at least this many rows with NumPy
+# instead of a loop, which is slower for a handful of rows.
+VECTORIZE_MIN_ROWS = 64
+
+# How often, in seconds, to check whether a Bloom filter file has been built or
+# replaced since it was loaded.
+BLOOM_CHECK_INTERVAL = 1
+
+# Maps upper-case ASCII letters to lower case, which is all that SQLite's NOCASE
+# collation folds.
+ASCII_CASE_FOLD = str.maketrans(
+  'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+  'abcdefghijklmnopqrstuvwxyz'
+)
+
+# Runs of characters that normalizeString() collapses into a single space.
+NORMALIZE_SEPARATORS_RE = re.compile(r'[\W_]+')
+
+def normalizeString(string):
+  """Normalizes a string for matching variants of the same anchor.
+
+  Accents are stripped, the string is case-folded, and runs of whitespace and
+  punctuation are collapsed into single spaces, so "Barack  Obama", "barack
+  obama." and "Barack Obamá" all normalize to "barack obama".
+
+  Args:
+    string: The string to normalize.
+
+  Returns: The normalized string.
+  """
+  decomposed = unicodedata.normalize('NFKD', string)
+  stripped = ''.join([c for c in decomposed if not unicodedata.combining(c)])
+  words = NORMALIZE_SEPARATORS_RE.sub(' ', stripped.casefold()).split()
+  return ' '.join(words)
 
 def getLabelCounts(info):
   """Gets the W, Wx, w, and w' values from the info string.
@@ -32,15 +99,34 @@ def parseRawCrosswikisRow(row):
     
   Returns: A tuple of the form (anchor, cprob, entity, info).
   """
-  tabParts = row.split('\t')
+  tabParts = row.rstrip('\n').split('\t')
   anchor=tabParts[0]
-  remainder = tabParts[1].split(' ')
+  middleParts = tabParts[1].split(' ')
   cprob = middleParts[0]
   entity = middleParts[1]
   info = ' '.join(middleParts[2:])
   return (anchor, cprob, entity, info)
 
 
+def formatLabelCounts(labelCounts):
+  """Formats label counts as an info string, the inverse of getLabelCounts().
+
+  Args:
+    labelCounts: A dict mapping the label name (W:, Wx:, w:, or w':) to a
+      (numerator, denominator) tuple.
+
+  Returns: The info string, e.g. 'W:152/69814 w:3/10'.
+  """
+  labels = ['W:', 'Wx:', 'w:', 'w\':']
+  return ' '.join([
+    '{label}{num}/{denom}'.format(
+      label=label,
+      num=labelCounts[label][0],
+      denom=labelCounts[label][1]
+    )
+    for label in labels if label in labelCounts
+  ])
+
 def parseRawInvCrosswikisRow(row):
   """Parses the fields from a row in inv.dict.
   
@@ -57,49 +143,324 @@ def parseRawInvCrosswikisRow(row):
   info=tabParts[2]
   return (entity, cprob, anchor, info)
 
-def query(queryString, args):
+def getShardKeyColumn(table):
+  """Gets the column a table is hash-partitioned on when it's sharded.
+
+  The forward tables are keyed on the anchor and the inverse tables on the
+  entity, which is what their lookups filter on.
+  """
+  return 'entity' if table.startswith('crosswikis_inv') else 'anchor'
+
+def getShard(key):
+  """Gets the shard a key is stored in, ignoring its case."""
+  keyHash = zlib.crc32(key.lower().encode('utf-8'))
+  return keyHash % constants.CROSSWIKIS_NUM_SHARDS
+
+def getDbPaths():
+  """Gets the paths of every database file the Crosswikis tables are in."""
+  if constants.CROSSWIKIS_NUM_SHARDS == 0:
+    return [constants.CROSSWIKIS_DB_PATH]
+  return [
+    constants.CROSSWIKIS_SHARD_PATH.format(shard=shard)
+    for shard in range(constants.CROSSWIKIS_NUM_SHARDS)
+  ]
+
+def getKeyDbPath(key):
+  """Gets the database file that holds the rows of a shard key."""
+  dbPaths = getDbPaths()
+  return dbPaths[getShard(key)] if len(dbPaths) > 1 else dbPaths[0]
+
+def getConnection(dbPath):
+  """Gets a connection to a database file.
+
+  If KEEP_CONNECTIONS_OPEN is set, each thread reuses its connections.
+  """
+  if not KEEP_CONNECTIONS_OPEN:
+    return sqlite3.connect(dbPath)
+  if not hasattr(_threadState, 'connections'):
+    _threadState.connections = {}
+  if dbPath not in _threadState.connections:
+    _threadState.connections[dbPath] = sqlite3.connect(dbPath)
+  return _threadState.connections[dbPath]
+
+def mapShards(function, *iterables):
+  """Maps the function over the iterables on one thread per database shard.
+
+  If KEEP_CONNECTIONS_OPEN is set, the threads are kept for later calls.
+
+  Returns: A list of the results, in order.
+  """
+  global _shardExecutor
+  numThreads = len(getDbPaths())
+  if not KEEP_CONNECTIONS_OPEN:
+    with concurrent.futures.ThreadPoolExecutor(numThreads) as executor:
+      return list(executor.map(function, *iterables))
+  if _shardExecutor is None:
+    _shardExecutor = concurrent.futures.ThreadPoolExecutor(numThreads)
+  return list(_shardExecutor.map(function, *iterables))
+
+def queryDb(dbPath, queryString, args):
+  """Executes the given query against one database file and yields the rows."""
+  connection = getConnection(dbPath)
+  try:
+    cursor = connection.cursor()
+    cursor.execute(queryString, args)
+    rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+    while len(rows) > 0:
+      yield from rows
+      rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+  finally:
+    if not KEEP_CONNECTIONS_OPEN:
+      connection.commit()
+      connection.close()
+
+def putUnlessStopped(itemQueue, item, stopped):
+  """Puts an item in a bounded queue, unless stopped is set while it's full."""
+  while not stopped.is_set():
+    try:
+      itemQueue.put(item, timeout=0.1)
+      return
+    except queue.Full:
+      pass
+
+def readShard(dbPath, queryString, args, batchQueue, stopped):
+  """Puts the rows of a query on one shard in a queue, for iterShardRows().
+
+  The rows are put in batches, followed by an empty batch. If the query fails,
+  the exception is put in the queue instead.
+  """
+  try:
+    rows = queryDb(dbPath, queryString, args)
+    batch = list(itertools.islice(rows, FETCH_BATCH_SIZE))
+    while len(batch) > 0 and not stopped.is_set():
+      putUnlessStopped(batchQueue, batch, stopped)
+      batch = list(itertools.islice(rows, FETCH_BATCH_SIZE))
+    rows.close()
+    putUnlessStopped(batchQueue, [], stopped)
+  except Exception as exception:
+    putUnlessStopped(batchQueue, exception, stopped)
+
+def iterShardRows(dbPaths, queryString, args):
+  """Executes a query on every shard in parallel and yields the rows of each
+  shard in turn.
+
+  Each shard is read on its own thread, which waits when it's SHARD_QUEUE_SIZE
+  batches ahead of the caller, so only that many rows per shard are held in
+  memory.
+  """
+  stopped = threading.Event()
+  batchQueues = [queue.Queue(SHARD_QUEUE_SIZE) for dbPath in dbPaths]
+  for dbPath, batchQueue in zip(dbPaths, batchQueues):
+    threading.Thread(
+      target=readShard,
+      args=(dbPath, queryString, args, batchQueue, stopped),
+      daemon=True
+    ).start()
+  try:
+    for batchQueue in batchQueues:
+      batch = batchQueue.get()
+      while isinstance(batch, Exception) or len(batch) > 0:
+        if isinstance(batch, Exception):
+          raise batch
+        yield from batch
+        batch = batchQueue.get()
+  finally:
+    stopped.set()
+
+def query(queryString, args, shardKey=None, orderKey=None):
   """Executes the given query and yields the results.
 
+  If the tables are sharded, the query is sent to the shard that holds
+  shardKey. Without a shardKey, it's sent to every shard and the rows are
+  streamed back as they're read. If the query is ordered, pass orderKey to merge
+  the shards' rows in order. Otherwise, the shards are read in parallel and the
+  rows of each shard are yielded in turn. Either way, aggregates only apply
+  within a shard.
+
   Args:
     queryString: The SQLite query string.
     args: A tuple with all the args to pass to the query string.
+    shardKey: The value of the table's shard key column (see
+      getShardKeyColumn()) that the query filters on, if any.
+    orderKey: If given, a function of a row that the query is ordered by, e.g.
+      the ASCII_CASE_FOLD of a column ordered with COLLATE NOCASE.
 
   Yields: The rows returned from the query.
   """
-  connection = sqlite3.connect(constants.CROSSWIKIS_DB_PATH)
-  cursor = connection.cursor()
-  for row in cursor.execute(queryString, args):
-    yield row
-  connection.commit()
-  connection.close()
+  dbPaths = getDbPaths()
+  if len(dbPaths) == 1:
+    yield from queryDb(dbPaths[0], queryString, args)
+  elif shardKey is not None:
+    yield from queryDb(getKeyDbPath(shardKey), queryString, args)
+  elif orderKey is not None:
+    yield from heapq.merge(
+      *[queryDb(dbPath, queryString, args) for dbPath in dbPaths],
+      key=orderKey
+    )
+  else:
+    yield from iterShardRows(dbPaths, queryString, args)
+
+def getFileVersion(path):
+  """Gets a tuple that changes when the file is replaced, or None if it doesn't
+  exist."""
+  try:
+    stat = os.stat(path)
+  except FileNotFoundError:
+    return None
+  return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+def getBloomFilter(path):
+  """Memory-maps a Bloom filter when it's first used.
+
+  Every BLOOM_CHECK_INTERVAL seconds, the file is checked again, and the filter
+  is reloaded if it has been built or replaced since, e.g. by
+  update_crosswikis.py.
+
+  Returns: The filter, or None if it hasn't been built.
+  """
+  with _bloomLock:
+    now = time.time()
+    if path in _bloomFilters:
+      bloomFilter, version, checkTime = _bloomFilters[path]
+      if now - checkTime < BLOOM_CHECK_INTERVAL:
+        return bloomFilter
+      if getFileVersion(path) == version:
+        _bloomFilters[path] = (bloomFilter, version, now)
+        return bloomFilter
+    version = getFileVersion(path)
+    bloomFilter = bloom.loadFilter(path) if version is not None else None
+    _bloomFilters[path] = (bloomFilter, version, now)
+    return bloomFilter
+
+def reloadBloomFilter(path):
+  """Drops a cached Bloom filter, so its next use loads the file again.
+
+  Used after a filter is saved in this process, which shouldn't wait out
+  BLOOM_CHECK_INTERVAL to see its new keys.
+  """
+  with _bloomLock:
+    _bloomFilters.pop(path, None)
+
+def mightHaveAnchor(string):
+  """Checks whether any table might have the string as an anchor, ignoring
+  case.
+
+  Returns: False if the Bloom filter built by build_crosswikis.py says no
+    anchor matches the string, True otherwise.
+  """
+  bloomFilter = getBloomFilter(constants.ANCHOR_BLOOM_PATH)
+  if bloomFilter is None:
+    return True
+  return bloom.mightContain(bloomFilter, string.translate(ASCII_CASE_FOLD))
+
+def mightHaveEntity(entity):
+  """Checks whether any table might have the entity.
+
+  Returns: False if the Bloom filter built by build_crosswikis.py says no
+    table has the entity, True otherwise.
+  """
+  bloomFilter = getBloomFilter(constants.ENTITY_BLOOM_PATH)
+  if bloomFilter is None:
+    return True
+  return bloom.mightContain(bloomFilter, entity)
 
-def aggregateResults(results):
+def getDbVersion():
+  """Gets a string that changes whenever the Crosswikis database is rewritten.
+
+  Results cached from one version of the database shouldn't be reused with
+  another.
+  """
+  versions = []
+  for dbPath in getDbPaths():
+    stat = os.stat(dbPath)
+    versions.append('{}-{}'.format(stat.st_mtime_ns, stat.st_size))
+  return ','.join(versions)
+
+def aggregateResults(results, normalized=False):
   """Aggregates results from crosswikis by ignoring case on the anchor.
 
   Numerators are added up, and probabilities are averaged, weighted by their
   numerators.
 
   Args:
-    results: a results set of the form [(anchor, entity, cprob, num, denom)]
+    results: An iterable of (anchor, entity, info, cprob) rows, such as the
+      rows of query().
+    normalized: If true, anchors are aggregated by normalizeString() instead of
+      just ignoring case.
 
   Returns: a new results set of the form [(anchor, entity, cprob, num, denom)]
   """
+  rows = list(results)
+  if len(rows) < VECTORIZE_MIN_ROWS:
+    groups = groupResults(rows, normalized)
+  else:
+    groups = groupResultsVectorized(rows, normalized)
+
+  denom = sum([num for (anchor, entity, num, cprobSum) in groups])
+  results = []
+  for anchor, entity, num, cprobSum in groups:
+    cprob = cprobSum / denom if denom != 0 else 0
+    results.append((anchor, entity, cprob, num, denom))
+  return results
+
+def groupResults(rows, normalized=False):
+  """Groups rows by folded anchor and entity, for aggregateResults().
+
+  Returns: A list of (anchor, entity, num, cprobSum) tuples in the order each
+    pair first appears, where num is the sum of the label numerators of the
+    pair's rows and cprobSum is the sum of their cprobs weighted by them.
+  """
   linkCounts = {}
   linkCprobs = {}
-  for anchor, entity, info, cprob in results:
-    anchor=anchor.lower()
+  for anchor, entity, info, cprob in rows:
+    anchor = normalizeString(anchor) if normalized else anchor.lower()
     labelCounts = getLabelCounts(info)
     num = sum([num for (num, denom) in labelCounts.values()])
     myutils.addToDict(linkCounts, (anchor, entity), num)
     myutils.addToDict(linkCprobs, (anchor, entity), num*cprob)
-  denom = sum(linkCounts.values())
-  results = []
-  for ((anchor, entity), num) in linkCounts.items():
-    cprob = linkCprobs[(anchor, entity)] / denom
-    results.append((anchor, entity, cprob, num, denom))
-  return results
+  return [
+    (anchor, entity, num, linkCprobs[(anchor, entity)])
+    for ((anchor, entity), num) in linkCounts.items()
+  ]
+
+def groupResultsVectorized(rows, normalized=False):
+  """Does the same as groupResults() with NumPy, for many rows.
 
-def getEntityDistribution(string, table='crosswikis'):
+  Anchors are folded and info strings are parsed once per distinct value, and
+  the sums of each pair are taken with bincount, which adds them up in the same
+  order as groupResults(), so the results are identical.
+  """
+  anchors, entities, infos, cprobs = zip(*rows)
+  foldAnchor = normalizeString if normalized else str.lower
+  uniqueAnchors, anchorCodes = np.unique(anchors, return_inverse=True)
+  foldedAnchors, foldedCodes = np.unique(
+    [foldAnchor(anchor) for anchor in uniqueAnchors.tolist()],
+    return_inverse=True
+  )
+  anchorCodes = foldedCodes[anchorCodes]
+  uniqueEntities, entityCodes = np.unique(entities, return_inverse=True)
+  uniqueInfos, infoCodes = np.unique(infos, return_inverse=True)
+  infoNums = np.array([
+    sum([num for (num, denom) in getLabelCounts(info).values()])
+    for info in uniqueInfos.tolist()
+  ], dtype=np.int64)
+  nums = infoNums[infoCodes]
+
+  pairCodes = anchorCodes.astype(np.int64) * len(uniqueEntities) + entityCodes
+  pairs, firstRows, pairIndices = np.unique(pairCodes, return_index=True,
+    return_inverse=True)
+  numSums = np.bincount(pairIndices, weights=nums).astype(np.int64)
+  cprobSums = np.bincount(pairIndices,
+    weights=nums * np.array(cprobs, dtype=np.float64))
+  order = np.argsort(firstRows, kind='stable')
+  return list(zip(
+    foldedAnchors[pairs[order] // len(uniqueEntities)].tolist(),
+    uniqueEntities[pairs[order] % len(uniqueEntities)].tolist(),
+    numSums[order].tolist(),
+    cprobSums[order].tolist(),
+  ))
+
+def getEntityDistribution(string, table='crosswikis', normalized=False):
   """Gets the distribution of entities linked to the synonym in Crosswikis.
 
   Queries the Crosswikis data for the string we're interested in, and gets a
@@ -108,21 +469,88 @@ def getEntityDistribution(string, table='crosswikis'):
   Args:
     string: The string to search for.
     table: The table to look for the string in.
+    normalized: If true, every anchor that normalizes to the same string (see
+      normalizeString()) is merged into the distribution, using the index built
+      by build_crosswikis.py. Otherwise, only case is ignored.
 
   Returns: A list of (entity, cprob, num, denom) tuples, sorted in descending
     order of conditional probability.
   """
-  queryString = (
-    'SELECT anchor, entity, info, cprob '
-    'FROM {table} '
-    'WHERE anchor=? COLLATE NOCASE'
-  ).format(table=table)
-  results = [row for row in query(queryString, (string,))]
+  if normalized:
+    # Variants of an anchor can be in any shard, so the query goes to all of
+    # them.
+    queryString = (
+      'SELECT anchor, entity, info, cprob '
+      'FROM {table} '
+      'WHERE norm_anchor=?'
+    ).format(table=table)
+    results = [row for row in query(queryString, (normalizeString(string),))]
+  elif not mightHaveAnchor(string):
+    results = []
+  else:
+    queryString = (
+      'SELECT anchor, entity, info, cprob '
+      'FROM {table} '
+      'WHERE anchor=? COLLATE NOCASE'
+    ).format(table=table)
+    results = [row for row in query(queryString, (string,), shardKey=string)]
 
-  results = [(e, c, n, d) for (a, e, c, n, d) in aggregateResults(results)]
+  results = [
+    (e, c, n, d) for (a, e, c, n, d) in
+    aggregateResults(results, normalized=normalized)
+  ]
   sortedResults = sorted(results, key=(lambda item: item[1]), reverse=True)
   return sortedResults
 
+def getEntityDistributions(strings, table='crosswikis'):
+  """Gets the entity distributions of many strings in batched lookups.
+
+  The strings are grouped by shard, and each shard is sent one query per batch
+  of strings, in parallel. Strings the anchor Bloom filter rules out aren't
+  queried at all.
+
+  Args:
+    strings: The strings to search for.
+    table: The table to look for the strings in.
+
+  Returns: A dict mapping each string to the list getEntityDistribution() would
+    return for it.
+  """
+  dbPaths = getDbPaths()
+  shardStrings = [[] for dbPath in dbPaths]
+  for string in set(strings):
+    if not mightHaveAnchor(string):
+      continue
+    shard = getShard(string) if len(dbPaths) > 1 else 0
+    shardStrings[shard].append(string)
+
+  def queryShard(dbPath, strings):
+    rows = []
+    for start in range(0, len(strings), MAX_BATCH_SIZE):
+      batch = strings[start:start + MAX_BATCH_SIZE]
+      queryString = (
+        'SELECT anchor, entity, info, cprob '
+        'FROM {table} '
+        'WHERE anchor COLLATE NOCASE IN ({params})'
+      ).format(table=table, params=', '.join(['?'] * len(batch)))
+      rows.extend(queryDb(dbPath, queryString, tuple(batch)))
+    return rows
+
+  shardRows = mapShards(queryShard, dbPaths, shardStrings)
+  rows = [row for rows in shardRows for row in rows]
+
+  foldKey = lambda string: string.translate(ASCII_CASE_FOLD)
+  anchorRows = {}
+  for row in rows:
+    anchorRows.setdefault(foldKey(row[0]), []).append(row)
+  distributions = {}
+  for string in strings:
+    results = aggregateResults(anchorRows.get(foldKey(string), []))
+    results = [(e, c, n, d) for (a, e, c, n, d) in results]
+    distributions[string] = sorted(results, key=(lambda item: item[1]),
+      reverse=True)
+  return distributions
+
 def getStringDistribution(entity, table='crosswikis_inv'):
   """Gets the distribution of strings linked to the entity in Crosswikis.
 
@@ -141,8 +569,157 @@ def getStringDistribution(entity, table='crosswikis_inv'):
     'FROM {table} '
     'WHERE entity=?'
   ).format(table=table)
-  results = [row for row in query(queryString, (string,))]
+  if mightHaveEntity(entity):
+    results = [row for row in query(queryString, (entity,), shardKey=entity)]
+  else:
+    results = []
 
-  results = [(e, c, n, d) for (a, e, c, n, d) in aggregateResults(results)]
+  results = [(a, c, n, d) for (a, e, c, n, d) in aggregateResults(results)]
   sortedResults = sorted(results, key=(lambda item: item[1]), reverse=True)
   return sortedResults
+
+def getAnchorShardBounds(table, numShards):
+  """Splits a table into ranges of anchors with roughly equal numbers of rows.
+
+  Anchors that only differ in (ASCII) case always land in the same range.
+
+  Args:
+    table: The table to split.
+    numShards: The number of ranges to split it into.
+
+  Returns: A list of (lowAnchor, highAnchor) tuples to pass to
+    iterAnchorDistributions(). None means the range is unbounded on that side.
+  """
+  # If the database is sharded, each query below runs on every database shard,
+  # so the counts are per shard and the bound is picked from the median of the
+  # shards' bounds.
+  countString = 'SELECT COUNT(*) FROM {table}'.format(table=table)
+  numRows = min([row[0] for row in query(countString, ())])
+  boundString = (
+    'SELECT anchor FROM {table} '
+    'ORDER BY anchor COLLATE NOCASE '
+    'LIMIT 1 OFFSET ?'
+  ).format(table=table)
+  foldKey = lambda anchor: anchor.translate(ASCII_CASE_FOLD)
+  bounds = []
+  for shard in range(1, numShards):
+    offset = shard * numRows // numShards
+    shardBounds = sorted(
+      [row[0] for row in query(boundString, (offset,))],
+      key=foldKey
+    )
+    bounds.append(shardBounds[len(shardBounds) // 2])
+  bounds = [None] + sorted(bounds, key=foldKey) + [None]
+  return list(zip(bounds[:-1], bounds[1:]))
+
+def iterAnchorDistributions(table='crosswikis', lowAnchor=None,
+    highAnchor=None, asciiFolded=False):
+  """Scans a table once and yields the entity distribution of every anchor.
+
+  The distributions are the same as getEntityDistribution() would return for
+  each anchor, but the whole range is read in a single ordered scan instead of
+  one query per anchor.
+
+  Args:
+    table: The table to scan.
+    lowAnchor: If given, only anchors >= lowAnchor (ignoring case) are scanned.
+    highAnchor: If given, only anchors < highAnchor (ignoring case) are scanned.
+    asciiFolded: If true, anchors are yielded with only ASCII letters lowered,
+      like SQLite's NOCASE collation, so each one is the key of exactly one
+      distribution.
+
+  Yields: (anchor, entityDistribution) tuples, where the anchor is lower-cased
+    and entityDistribution is a list of (entity, cprob, num, denom) tuples,
+    sorted in descending order of conditional probability.
+  """
+  conditions = []
+  args = []
+  if lowAnchor is not None:
+    conditions.append('anchor >= ? COLLATE NOCASE')
+    args.append(lowAnchor)
+  if highAnchor is not None:
+    conditions.append('anchor < ? COLLATE NOCASE')
+    args.append(highAnchor)
+  whereClause = 'WHERE ' + ' AND '.join(conditions) if conditions else ''
+  queryString = (
+    'SELECT anchor, entity, info, cprob '
+    'FROM {table} {where} '
+    'ORDER BY anchor COLLATE NOCASE'
+  ).format(table=table, where=whereClause)
+
+  groupKey = lambda row: row[0].translate(ASCII_CASE_FOLD)
+  rows = query(queryString, tuple(args), orderKey=groupKey)
+  for key, group in itertools.groupby(rows, key=groupKey):
+    results = aggregateResults(list(group))
+    anchor = key if asciiFolded else results[0][0]
+    results = [(e, c, n, d) for (a, e, c, n, d) in results]
+    sortedResults = sorted(results, key=(lambda item: item[1]), reverse=True)
+    yield anchor, sortedResults
+
+def getFeaturesTable(table):
+  """Gets the name of the anchor feature table built for a forward table."""
+  return table + '_features'
+
+def hasTable(table):
+  """Checks whether a table has been built, remembering the answer until
+  forgetTables() is called."""
+  dbPath = getDbPaths()[0]
+  if (dbPath, table) not in _hasTable:
+    queryString = (
+      'SELECT COUNT(*) FROM sqlite_master WHERE type=\'table\' AND name=?'
+    )
+    rows = list(queryDb(dbPath, queryString, (table,)))
+    _hasTable[(dbPath, table)] = rows[0][0] > 0
+  return _hasTable[(dbPath, table)]
+
+def forgetTables():
+  """Forgets the answers of hasTable(), after tables are built or dropped."""
+  _hasTable.clear()
+
+def getAnchorFeatures(string, table='crosswikis'):
+  """Gets the precomputed features of the entity distribution of a string.
+
+  Reads the feature table built for the table by build_crosswikis.py, which has
+  to exist (see hasTable()).
+
+  Args:
+    string: The string to look up, ignoring (ASCII) case.
+    table: The forward table the features were computed from.
+
+  Returns: None if the string isn't an anchor in the table. Otherwise, a dict
+    with:
+      topEntities: The first (entity, cprob, num, denom) tuples that
+        getEntityDistribution() returns, up to the number the table was built
+        with.
+      top1Top2Ratio: The cprob of the top entity divided by the second's, inf
+        if the second's is 0, or None if there's only one entity.
+      entropy: The entropy, in bits, of the entities' share of the total count.
+      totalCount: The total count of the anchor.
+      numEntities: The number of distinct entities linked to the anchor.
+  """
+  if not mightHaveAnchor(string):
+    return None
+  key = string.translate(ASCII_CASE_FOLD)
+  queryString = (
+    'SELECT top_entities, top_cprobs, top_nums, top1_top2_ratio, entropy, '
+    'total_count, num_entities '
+    'FROM {table} '
+    'WHERE anchor=?'
+  ).format(table=getFeaturesTable(table))
+  rows = [row for row in query(queryString, (key,), shardKey=key)]
+  if len(rows) == 0:
+    return None
+  (entities, cprobs, nums, top1Top2Ratio, entropy, totalCount,
+    numEntities) = rows[0]
+  topEntities = [
+    (entity, float(cprob), int(num), totalCount)
+    for (entity, cprob, num) in
+    zip(entities.split('\t'), cprobs.split('\t'), nums.split('\t'))
+  ]
+  return {
+    'topEntities': topEntities,
+    'top1Top2Ratio': top1Top2Ratio,
+    'entropy': entropy,
+    'totalCount': totalCount,
+    'numEntities': numEntities,
+  }
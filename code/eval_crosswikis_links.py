@@ -7,6 +7,11 @@
 # column. We want to see how many of these entities were correctly linked, and
 # with what probability.
 
+import bootstrap
+import crosswikis
+import math
+import numpy as np
+
 SYNONYM_DEV_SET = (
   '/home/jstn/research/knowitall/synonym-data-eval/data/str-to-ents-dev-set'
 )
@@ -94,7 +99,43 @@ def printCorrectLinkData(synonymSet, cwLinkData):
           if entity == correctEntity:
             printLink(entity, synonym, cprob, idx)
 
-def printRank1Links(synonymSet, cwLinkData):
+def getRank1Link(cwLinkData, correctEntity, synonym, table=None):
+  """Gets the most likely entity given a synonym.
+
+  Args:
+    cwLinkData: A dict with correctEntity as the key, that maps to nested dicts
+      with the synonym as the key, which maps to a list of (entity, cprob, num,
+      denom) tuples.
+    correctEntity: The entity the synonym is for.
+    synonym: The synonym.
+    table: If given, the link is read from the anchor feature table of this
+      Crosswikis table instead of cwLinkData, if the feature table has been
+      built.
+
+  Returns: An (entity, cprob, prob2Ratio) tuple, where prob2Ratio is the ratio
+    of the probability of the entity to the probability of the second entity,
+    or None if there's no second entity. Returns None if the synonym has no
+    links.
+  """
+  if table is not None and crosswikis.hasTable(
+      crosswikis.getFeaturesTable(table)):
+    features = crosswikis.getAnchorFeatures(synonym, table=table)
+    if features is None:
+      return None
+    entity, cprob, num, denom = features['topEntities'][0]
+    prob2Ratio = features['top1Top2Ratio']
+    return entity, cprob, 'Inf' if prob2Ratio == math.inf else prob2Ratio
+
+  if synonym not in cwLinkData.get(correctEntity, {}):
+    return None
+  entity, cprob, num, denom = cwLinkData[correctEntity][synonym][0]
+  prob2Ratio = None
+  if len(cwLinkData[correctEntity][synonym]) > 1:
+    cprob2 = cwLinkData[correctEntity][synonym][1][1]
+    prob2Ratio = cprob/cprob2 if cprob2 != 0 else 'Inf'
+  return entity, cprob, prob2Ratio
+
+def printRank1Links(synonymSet, cwLinkData, table=None):
   """Prints the most likely entity given a string, as well as its likelihood.
 
   Also prints out the ratio of the probability of the first entity to the
@@ -104,18 +145,18 @@ def printRank1Links(synonymSet, cwLinkData):
     synonymSet: A dict mapping entities to its list of synonyms.
     cwLinkData: A dict with correctEntity as the key, that maps to nested dicts
       with the synonym as the key, which maps to a list of (entity, cprob, num,
-      denom) tuples.
+      denom) tuples. Not used if table is given.
+    table: If given, the links are read from the anchor feature table of this
+      Crosswikis table (see build_crosswikis.py) instead of cwLinkData, if the
+      feature table has been built.
   """
   count = 0
   for correctEntity, synonyms in synonymSet.items():
     for synonym in synonyms:
       count += 1
-      if synonym in cwLinkData[correctEntity]:
-        entity, cprob, num, denom = cwLinkData[correctEntity][synonym][0]
-        prob2Ratio = None
-        if len(cwLinkData[correctEntity][synonym]) > 1:
-          cprob2 = cwLinkData[correctEntity][synonym][1][1]
-          prob2Ratio = cprob/cprob2 if cprob2 != 0 else 'Inf'
+      rank1Link = getRank1Link(cwLinkData, correctEntity, synonym, table)
+      if rank1Link is not None:
+        entity, cprob, prob2Ratio = rank1Link
         print('{correct}\t{synonym}\t{entity}\t{cprob}\t{prob2Ratio}'.format(
             correct=correctEntity,
             synonym=synonym,
@@ -131,7 +172,7 @@ def printRank1Links(synonymSet, cwLinkData):
           )
         )
 
-def evalRank1Test(synonymSet, cwLinkData):
+def evalRank1Test(synonymSet, cwLinkData, table=None):
   """Finds the precision and recall when we just pick the most likely entity.
 
   We pick the most likely entity in the distribution, but subject it to some
@@ -142,27 +183,87 @@ def evalRank1Test(synonymSet, cwLinkData):
     synonymSet: A dict mapping entities to its list of synonyms.
     cwLinkData: A dict with correctEntity as the key, that maps to nested dicts
       with the synonym as the key, which maps to a list of (entity, cprob, num,
-      denom) tuples.
+      denom) tuples. Not used if table is given.
+    table: If given, the most likely entities are read from the anchor feature
+      table of this Crosswikis table instead of cwLinkData, if the feature
+      table has been built.
   """
-  numSynonyms = sum([len(list) for list in synonymSet.values()])
-  print('CProb cutoff\tPrecision\tRecall')
-
-  for cprobCutoff in [x/100 for x in range(0, 100, 5)]:
-    numCorrect = 0
-    numRetrieved = 0
-
-    for correctEntity, synonymEntities in cwLinkData.items():
-      for synonym, entityList in synonymEntities.items():
-        if synonym not in synonymSet[correctEntity]:
-          continue
-        entity, cprob, num, denom = entityList[0]
-        if cprob >= cprobCutoff:
-          numRetrieved += 1
-          if entity == correctEntity:
-            numCorrect += 1
+  print('CProb cutoff\tPrecision\tRecall\tPrecision low\tPrecision high'
+    '\tRecall low\tRecall high\tF1 low\tF1 high')
+
+  cprobCutoffs = [x/100 for x in range(0, 100, 5)]
+  groupIds, topCprobs, hits = getRank1Rows(synonymSet, cwLinkData, table)
+  returned = topCprobs >= np.array(cprobCutoffs)[:, np.newaxis]
+  returned &= topCprobs >= 0
+  intervals = getRank1Intervals(groupIds, returned, hits)
+  numSynonyms = len(hits)
+  for cprobCutoff, cutoffReturned, interval in zip(cprobCutoffs, returned,
+      intervals):
+    numRetrieved = int(np.sum(cutoffReturned))
+    numCorrect = int(np.sum(cutoffReturned & hits))
     precision = numCorrect / numRetrieved
     recall = numCorrect / numSynonyms
-    print('{0}\t{1}\t{2}'.format(cprobCutoff, precision, recall))
+    print('\t'.join([str(value) for value in
+      (cprobCutoff, precision, recall) + tuple(interval)]))
+
+def getRank1Rows(synonymSet, cwLinkData, table=None):
+  """Gets one row per synonym in the synonym set for evalRank1Test().
+
+  A synonym that's listed more than once for an entity has a row for each time
+  it's listed, which counts towards the recall, but only the first one can be
+  returned.
+
+  Args:
+    synonymSet: A dict mapping entities to its list of synonyms.
+    cwLinkData: A dict with correctEntity as the key, that maps to nested dicts
+      with the synonym as the key, which maps to a list of (entity, cprob, num,
+      denom) tuples.
+    table: Passed to getRank1Link().
+
+  Returns: A (groupIds, topCprobs, hits) tuple of arrays with an entry per row.
+    groupIds has the index of the row's entity in synonymSet, topCprobs has the
+    cprob of the synonym's most likely entity, or -1 if the row can't be
+    returned, and hits is true if the most likely entity is the correct one.
+  """
+  groupIds = []
+  topCprobs = []
+  hits = []
+  for groupId, (correctEntity, synonyms) in enumerate(synonymSet.items()):
+    seenSynonyms = set()
+    for synonym in synonyms:
+      groupIds.append(groupId)
+      rank1Link = None
+      if synonym not in seenSynonyms:
+        rank1Link = getRank1Link(cwLinkData, correctEntity, synonym, table)
+      if rank1Link is not None:
+        entity, cprob, prob2Ratio = rank1Link
+        topCprobs.append(cprob)
+        hits.append(entity == correctEntity)
+      else:
+        topCprobs.append(-1)
+        hits.append(False)
+      seenSynonyms.add(synonym)
+  return np.array(groupIds), np.array(topCprobs), np.array(hits, dtype=bool)
+
+def getRank1Intervals(groupIds, returned, hits, seed=bootstrap.SEED):
+  """Gets bootstrap confidence intervals for evalRank1Test().
+
+  The test entities are resampled, along with all of their synonyms.
+
+  Args:
+    groupIds: The groupIds array from getRank1Rows().
+    returned: A (numCutoffs, numRows) boolean array of the rows returned at
+      each cutoff.
+    hits: The hits array from getRank1Rows().
+    seed: The seed for the random number generator.
+
+  Returns: A list with a (precisionLow, precisionHigh, recallLow, recallHigh,
+    f1Low, f1High) tuple for each cutoff.
+  """
+  weights = bootstrap.getResampleWeights(groupIds, seed=seed)
+  intervals = bootstrap.getPrIntervals(returned, hits, np.ones(len(hits)),
+    weights)
+  return list(zip(*[values.tolist() for values in intervals]))
 
 def main():
   cwLinkFile = open(SYNONYM_ENTITY_DIST_PATH)
@@ -170,7 +271,7 @@ def main():
   synonymDevSetFile = open(SYNONYM_DEV_SET)
   synonymDevSet = getSynonymSet(synonymDevSetFile)
 
-  evalRank1Test(synonymDevSet, cwLinkData)
+  evalRank1Test(synonymDevSet, cwLinkData, table='crosswikis')
   #printCorrectLinkData(synonymDevSet, cwLinkData)
   #print(sum([len(list) for list in synonymDevSet.values()]))
   #printRank1Links(synonymDevSet, cwLinkData)
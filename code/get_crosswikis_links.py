@@ -2,6 +2,7 @@
 # conditional probabilities of those entities after ignoring case. Gets test
 # synonyms from a file.
 
+import metrics
 import re
 import sqlite3
 
@@ -92,7 +93,6 @@ def getEntityDistribution(synonym, cursor):
   entityCounts = {}
 
   for anchor, entity, info in cursor.execute(query, (synonym,)):
-    print('a={}, e={}, i={}'.format(anchor, entity, info))
     num = parseRowInfo(info)
     addToDictCount(entityCounts, entity, num)
 
@@ -138,11 +138,13 @@ def main():
   connection = sqlite3.connect(CROSSWIKIS_DB_PATH)
   cursor = connection.cursor()
 
+  stage = metrics.startStage('crosswikis_links', total=len(testSet))
   for entity, synonyms in testSet.items():
-    print(entity)
-    for synonym in synonyms:
-      entityDistribution = getEntityDistribution(synonym, cursor)
-      printEntityDistribution(entity, synonym, entityDistribution)
+    with metrics.timeItem(stage):
+      for synonym in synonyms:
+        entityDistribution = getEntityDistribution(synonym, cursor)
+        printEntityDistribution(entity, synonym, entityDistribution)
+  metrics.writeMetrics()
 
   connection.commit()
   connection.close()
@@ -1,6 +1,7 @@
 import constants
 import crosswikis
 import openie
+import sys
 
 SYNONYM_PATH = constants.DATA_PATH + 'cwel-test-set-abe'
 TEMP_OUTPUT_PATH = constants.RESULTS_PATH + 'openie-counts-temp'
@@ -13,17 +14,34 @@ def getStrings(synonymsFile):
     strings.append(anchor)
   return strings
 
-def getCounts(strings):
+def getCounts(strings, bulk=False, numWorkers=1):
+  """Gets the Open IE tuple counts of the strings.
+
+  Args:
+    strings: The strings to count.
+    bulk: If true, the counts are computed from the local extractions dump (see
+      openie.writeBulkNumInstances()) instead of being read from the output of
+      the backend.
+    numWorkers: The number of processes to count the extractions dump with.
+  """
 #  for string in strings:
 #    openie.writeNumInstances(string, TEMP_OUTPUT_PATH)
+  if bulk:
+    openie.writeBulkNumInstances(TEMP_OUTPUT_PATH, strings=strings,
+      numWorkers=numWorkers)
   tempOutputFile = open(TEMP_OUTPUT_PATH)
   return openie.getNumInstances(tempOutputFile)
 
 def main():
+  """Usage:
+    python get_openie_freqs.py [bulk [{numWorkers}]]
+  """
   synonymsFile = open(SYNONYM_PATH)
   strings = getStrings(synonymsFile)
 
-  instanceCounts = getCounts(strings)
+  bulk = len(sys.argv) > 1 and sys.argv[1] == 'bulk'
+  numWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else 1
+  instanceCounts = getCounts(strings, bulk=bulk, numWorkers=numWorkers)
   outputFile = open(OUTPUT_PATH, 'w')
   for (string, count) in instanceCounts.items():
     print('{}\t{}'.format(string, count), file=outputFile)
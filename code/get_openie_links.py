@@ -1,6 +1,14 @@
 # Evaluates the synonyms from the current Open IE entity linker.
+import ids
+import metrics
+import multiprocessing
+import myutils
+import numpy as np
 import os
 import re
+import shutil
+import tempfile
+import time
 
 SYNONYM_DEV_SET_PATH = ('/home/jstn/research/knowitall/synonym-data-eval/data/'
   'odd-synonym-dev-set')
@@ -8,6 +16,13 @@ OPENIE_BACKEND_JAR_PATH = ('/home/jstn/research/knowitall/openie-backend/'
   'target/openiedemo-backend-1.0.2-SNAPSHOT-jar-with-dependencies.jar')
 OPENIE_ENTITYLINKS_PATH = ('/home/jstn/research/knowitall/synonym-data-eval/'
   'results/openie-odd-entitylinks')
+OPENIE_ENTITYLINKS_DIST_PATH = ('/home/jstn/research/knowitall/'
+  'synonym-data-eval/results/openie-odd-entitylinks-dist')
+OPENIE_ENTITYLINKS_DIST_IDS_PATH = OPENIE_ENTITYLINKS_DIST_PATH + '.ids'
+
+# The most distinct (synonym, entity) pairs a worker counts in memory before
+# spilling a sorted run to disk.
+SPILL_MAX_KEYS = 1000000
 
 def getTestSynonyms(testSetFile):
   """Gets dicts for fbids, entities and synonyms from the test set file.
@@ -41,10 +56,10 @@ def getEntityLinks(testSet):
       synonyms for that entity.
     entityLinksFile: The file the results should be written to.
   """
-  testSetSize = len(testSet)
-  for index, (entity, synonyms) in enumerate(testSet.items(), start=1):
-    print ("Querying synonyms for {entity} ({index} of {size})".format(
-      entity=entity, index=index, size=testSetSize))
+  stage = metrics.startStage('openie_entity_links', total=len(testSet))
+  for entity, synonyms in testSet.items():
+    startTime = time.time()
+    failed = False
     for synonym in synonyms:
       command = ('java -jar {jarFile} --arg{argn} "{string}" --noInst '
         '--tabOutput '
@@ -63,8 +78,10 @@ def getEntityLinks(testSet):
         string=synonym,
         fields='3,5',
         outputPath=OPENIE_ENTITYLINKS_PATH)
-      os.system(arg1Command)
-      os.system(arg2Command)
+      failed |= os.system(arg1Command) != 0
+      failed |= os.system(arg2Command) != 0
+    metrics.recordItem(stage, time.time() - startTime, error=failed)
+  metrics.writeMetrics()
 
 def addToDistribution(distribution, key, distKey):
   """Adds distKey to the distribution map with some key.
@@ -104,16 +121,135 @@ def getFbidDistribution(testSet):
   entityLinksFile = open(OPENIE_ENTITYLINKS_PATH)
   fbidDistribution = {}
   for line in entityLinksFile:
-    lineParts = line.split('\t')
-    synonym = lineParts[0]
-    entityInfoString = lineParts[1].strip()
-    if entityInfoString != 'X':
-      entityInfo = entityInfoString.split(',')
-      entity = entityInfo[0]
-      fbid = entityInfo[1]
+    link = parseEntityLink(line)
+    if link is not None:
+      synonym, entity = link
       addToDistribution(fbidDistribution, synonym, entity)
   return fbidDistribution
 
+def parseEntityLink(line):
+  """Parses a line of the entity links file written by getEntityLinks().
+
+  Args:
+    line: A line of the form {synonym}{TAB}{entity},{fbid}, or
+      {synonym}{TAB}X if the synonym wasn't linked.
+
+  Returns: A (synonym, entity) tuple, or None if the synonym wasn't linked.
+  """
+  lineParts = line.split('\t')
+  synonym = lineParts[0]
+  entityInfoString = lineParts[1].strip()
+  if entityInfoString == 'X':
+    return None
+  entityInfo = entityInfoString.split(',')
+  entity = entityInfo[0]
+  return synonym, entity
+
+def spillEntityLinkRange(byteRange, runDir, maxKeys):
+  """Counts the entity links in a byte range of the entity links file.
+
+  Args:
+    byteRange: A (start, end) tuple from myutils.getByteRanges().
+    runDir: The directory to spill sorted runs of partial counts to.
+    maxKeys: The most (synonym, entity) pairs to hold in memory at once.
+
+  Returns: A list of paths to the sorted runs that were written.
+  """
+  start, end = byteRange
+  links = (
+    parseEntityLink(line) for line in
+    myutils.readLinesInRange(OPENIE_ENTITYLINKS_PATH, start, end)
+  )
+  keys = (
+    '{}\t{}'.format(synonym, entity) for (synonym, entity) in
+    (link for link in links if link is not None)
+  )
+  return myutils.countWithSpill(keys, runDir, maxKeys)
+
+def writeFbidDistribution(outputPath=OPENIE_ENTITYLINKS_DIST_PATH,
+    numWorkers=1, maxKeys=SPILL_MAX_KEYS,
+    idsPath=OPENIE_ENTITYLINKS_DIST_IDS_PATH):
+  """Computes the same counts as getFbidDistribution() with bounded memory.
+
+  The entity links file is split into byte ranges that are parsed in parallel.
+  Each worker spills its partial counts to sorted runs on disk, and the runs are
+  combined with a k-way merge.
+
+  Args:
+    outputPath: The file to write the distribution to, one line per
+      {synonym}{TAB}{entity}{TAB}{count}, sorted by synonym and entity.
+    numWorkers: The number of processes to parse the input with.
+    maxKeys: The most (synonym, entity) pairs each worker holds in memory.
+    idsPath: If given, the distribution is also written here with integer IDs
+      (see writeFbidDistributionIds()).
+  """
+  runDir = tempfile.mkdtemp(dir=os.path.dirname(outputPath))
+  byteRanges = myutils.getByteRanges(OPENIE_ENTITYLINKS_PATH, numWorkers)
+  spillArgs = [(byteRange, runDir, maxKeys) for byteRange in byteRanges]
+  if numWorkers > 1:
+    with multiprocessing.Pool(numWorkers) as pool:
+      runPathLists = pool.starmap(spillEntityLinkRange, spillArgs)
+  else:
+    runPathLists = [spillEntityLinkRange(*args) for args in spillArgs]
+
+  runPaths = [runPath for runPathList in runPathLists for runPath in runPathList]
+  with open(outputPath, 'w') as outputFile:
+    for key, count in myutils.mergeSortedRuns(runPaths):
+      print('{}\t{}'.format(key, count), file=outputFile)
+  shutil.rmtree(runDir)
+  if idsPath is not None:
+    writeFbidDistributionIds(outputPath, idsPath)
+
+def readFbidDistribution(distributionFile):
+  """Reads a distribution file written by writeFbidDistribution().
+
+  Yields: (synonym, entity, count) tuples, sorted by synonym and entity.
+  """
+  for line in distributionFile:
+    synonym, entity, count = line.rstrip('\n').split('\t')
+    yield synonym, entity, int(count)
+
+def writeFbidDistributionIds(distributionPath, idsPath):
+  """Writes a distribution file from writeFbidDistribution() with integer IDs.
+
+  Synonyms and entities are interned into the persisted ID maps of the ids
+  module, which are saved again with any strings they didn't have.
+
+  Args:
+    distributionPath: The distribution file to convert.
+    idsPath: The file to write a packed array of (synonymId, entityId, count)
+      triples to, in the order of the distribution file.
+  """
+  entityIds, anchorIds = ids.loadIdMaps()
+  def iterValues():
+    with open(distributionPath) as distributionFile:
+      for synonym, entity, count in readFbidDistribution(distributionFile):
+        yield ids.internAnchor(anchorIds, synonym)
+        yield ids.internString(entityIds, entity)
+        yield count
+  with open(idsPath, 'wb') as idsFile:
+    ids.writeIdArray(iterValues(), idsFile)
+  ids.saveIdMaps(entityIds, anchorIds)
+
+def readFbidDistributionIds(idsFile):
+  """Reads a distribution written by writeFbidDistributionIds().
+
+  Synonyms that only differ in case have the same ID, so their counts are added
+  up.
+
+  Args:
+    idsFile: The file, opened in binary mode.
+
+  Returns: (synonymIds, entityIds, counts) NumPy arrays, sorted by synonym ID
+    and entity ID.
+  """
+  triples = np.frombuffer(ids.readIdArray(idsFile), dtype=np.int64)
+  triples = triples.reshape(-1, 3)
+  pairs, pairIndices = np.unique(triples[:, :2], axis=0, return_inverse=True)
+  counts = np.bincount(pairIndices.ravel(), weights=triples[:, 2],
+    minlength=len(pairs))
+  return pairs[:, 0], pairs[:, 1], counts.astype(np.int64)
+
 def main():
   """Run this program twice. First, uncomment getEntityLinks, and comment
   everything below it out. This will generate a file with all the entity links
@@ -127,12 +263,16 @@ def main():
   # Only run this as needed! Takes a while.
   getEntityLinks(testSet)
 
-#  fbidDistribution = getFbidDistribution(testSet)
-#  for synonym, dist in fbidDistribution.items():
-#    print(synonym)
-#    for fbid, count in dist.items():
-#      entity = fbidToEntityMap[fbid] if fbid in fbidToEntityMap else fbid
-#      print('  {entity}: {count}'.format(entity=entity, count=count))
+#  writeFbidDistribution(numWorkers=os.cpu_count())
+#  entityIds, anchorIds = ids.loadIdMaps()
+#  with open(OPENIE_ENTITYLINKS_DIST_IDS_PATH, 'rb') as idsFile:
+#    synonymIds, fbidIds, counts = readFbidDistributionIds(idsFile)
+#  for synonymId, fbidId, count in zip(synonymIds, fbidIds, counts):
+#    synonym = ids.lookupString(anchorIds, synonymId)
+#    fbid = ids.lookupString(entityIds, fbidId)
+#    entity = fbidToEntityMap[fbid] if fbid in fbidToEntityMap else fbid
+#    print('{synonym}\t{entity}\t{count}'.format(synonym=synonym,
+#      entity=entity, count=count))
 
 if __name__ == '__main__':
   main()
@@ -1,15 +1,40 @@
+import bootstrap
 import constants
 import crosswikis as cw
+import itertools
+import metrics
+import multiprocessing
 import myutils
+import numpy as np
+import os
+import shutil
+import tempfile
 
 TEST_SET_PATH = constants.DATA_PATH + 'cwel-test-set'
 STRING_COUNTS_PATH = constants.RESULTS_PATH + 'openie-counts'
 
 MY_RESULTS_PATH = constants.RESULTS_PATH + 'cwel/'
 LINK_STATS_PATH= MY_RESULTS_PATH + '1-link-stats.tsv'
+LINK_STORE_PATH = MY_RESULTS_PATH + '1-link-stats-store.tsv'
 PR_OUTPUT_PATH = MY_RESULTS_PATH + '2-cwel-entity-sets-pr.tsv'
 SYNSETS_OUTPUT_PATH = constants.RESULTS_PATH + '2-cwel-entity-sets.tsv'
 PR_DEDUPED_PATH = MY_RESULTS_PATH + '3-cwel-pr-deduped.tsv'
+CORPUS_SYNSETS_OUTPUT_PATH = (
+  constants.RESULTS_PATH + '2-cwel-corpus-entity-sets.tsv'
+)
+
+# The thresholds swept by tryThresholds().
+CPROB_THRESHOLDS = [x/100 for x in range(0, 100, 5)]
+COUNT_THRESHOLDS = [10, 100, 500, 1000, 1500, 2000, 4000, 10000]
+TUPLE_THRESHOLDS = list(range(10, 2000, 100))
+
+# The most (entity, synonym) pairs each shard holds in memory before spilling a
+# sorted run to disk when generating synonym sets for the whole corpus.
+CORPUS_SPILL_MAX_KEYS = 1000000
+
+# The number of anchors whose links are thresholded together when generating
+# synonym sets for the whole corpus.
+CORPUS_BATCH_SIZE = 10000
 
 def readStringCountsFile(stringCountsFile):
   """Reads the Open IE string counts file and returns its contents.
@@ -28,11 +53,18 @@ def readStringCountsFile(stringCountsFile):
     stringCounts[string] = count
   return stringCounts
 
-def getLinkRow(table, entity, string):
+def getLinkRow(table, entity, string, stage=None):
   """Queries the given crosswikis table for an entity and a string.
   
   Assumes the string is case-insensitive.
 
+  Args:
+    table: The table to query.
+    entity: The entity of the link.
+    string: The string of the link.
+    stage: If given, a metrics stage to record an error in if the table has no
+      such link.
+
   Returns: a tuple with the cprob, numerator, and denominator of that link.
   """
   queryString = (
@@ -40,18 +72,74 @@ def getLinkRow(table, entity, string):
     'FROM {table} '
     'WHERE entity=? AND anchor=? COLLATE NOCASE'
   ).format(table=table)
-  results = [
-    row for row in
-    cw.query(queryString, (entity, string))
-  ]
+  shardKey = entity if cw.getShardKeyColumn(table) == 'entity' else string
+  if cw.mightHaveEntity(entity) and cw.mightHaveAnchor(string):
+    results = [
+      row for row in
+      cw.query(queryString, (entity, string), shardKey=shardKey)
+    ]
+  else:
+    results = []
   results = cw.aggregateResults(results)
   if len(results) == 0:
-    print('No results when querying entity/string pair.')
+    if stage is not None:
+      metrics.recordError(stage)
     return 0, 0, None
   string, entity, cprob, num, denom = results[0]
   return cprob, num, denom
 
-def getLinkStats():
+def parseTestSetLine(line):
+  """Parses a line of the test set.
+
+  Returns: An (entity, string, correct) tuple.
+  """
+  lineParts = [part.strip() for part in line.split('\t')]
+  entity = lineParts[0]
+  string = lineParts[1]
+  correct = True if lineParts[2] == '1' else False
+  return entity, string, correct
+
+def getPairStats(entity, string, stage=None):
+  """Queries Crosswikis for the stats of an (entity, string) pair.
+
+  Args:
+    entity: The entity of the pair.
+    string: The string of the pair.
+    stage: If given, a metrics stage to record missing links in.
+
+  Returns: A (cprob, invCprob, cwCount) tuple, where cprob is p(entity|string),
+    invCprob is p(string|entity) and cwCount is the count of the pair.
+  """
+  cprob, cwCount, cwDenom = getLinkRow('crosswikis_subset', entity, string,
+    stage)
+  invCprob, invCwCount, invCwDenom = getLinkRow(
+    'crosswikis_inv_subset',
+    entity,
+    string,
+    stage
+  )
+  return cprob, invCprob, cwCount
+
+def printLinkStatsHeader(linkStatsFile):
+  print('Entity\tString\tP(Entity|String)\tP(String|Entity)\tCrosswikis count'
+    '\tTuple count', file=linkStatsFile, flush=True)
+
+def printLinkStatsRow(linkStatsFile, entity, string, correct, cprob, invCprob,
+    cwCount, tupleCount):
+  print('{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
+      entity,
+      string,
+      1 if correct else 0,
+      cprob,
+      invCprob,
+      cwCount,
+      tupleCount,
+    ),
+    file=linkStatsFile,
+    flush=True
+  )
+
+def getLinkStats(incremental=True):
   """Retrieves stats for each (entity, string) pair in the test set.
 
   For each (entity, string) pair, return:
@@ -63,47 +151,122 @@ def getLinkStats():
   Save the results to disk and return the data as a list of tuples (in the above
   order).
 
+  The Crosswikis results for each pair are kept in a store at LINK_STORE_PATH.
+  When run incrementally against the same database, only pairs that aren't in
+  the store are queried, and pairs that are no longer in the test set are
+  dropped from it. The link stats file is always rewritten in full.
+
+  Args:
+    incremental: If false, every pair is queried again.
+
   Returns: a list of tuples of the form (entityCprob, stringCprob, cwCount,
     tupleCount, tupleCountNorm)
   """
   testSetFile = open(TEST_SET_PATH)
   stringCountsFile = open(STRING_COUNTS_PATH)
   stringCounts = readStringCountsFile(stringCountsFile)
+  dbVersion = cw.getDbVersion()
+  linkStore = loadLinkStore(dbVersion) if incremental else {}
+  newLinkStore = {}
   linkStatsFile = open(LINK_STATS_PATH, 'w')
+  numLines = sum([1 for line in testSetFile])
+  testSetFile.seek(0)
+  stage = metrics.startStage('link_stats', total=numLines)
     
-  print('Entity\tString\tP(Entity|String)\tP(String|Entity)\tCrosswikis count'
-    '\tTuple count', file=linkStatsFile, flush=True)
+  printLinkStatsHeader(linkStatsFile)
   for line in testSetFile:
-    lineParts = [part.strip() for part in line.split('\t')]
-    entity = lineParts[0]
-    string = lineParts[1]
-    correct = True if lineParts[2] == '1' else False
-    
-    print('Getting data on ({}, {})'.format(entity, string))
+    entity, string, correct = parseTestSetLine(line)
     
     tupleCount = stringCounts[string]
     if tupleCount < 10:
+      metrics.recordItem(stage)
       continue
 
-    cprob, cwCount, cwDenom = getLinkRow('crosswikis_subset', entity, string)
-    invCprob, invCwCount, invCwDenom = getLinkRow(
-      'crosswikis_inv_subset',
-      entity,
-      string
-    )
+    if (entity, string) in linkStore:
+      cprob, invCprob, cwCount = linkStore[(entity, string)]
+      metrics.recordItem(stage)
+    else:
+      with metrics.timeItem(stage):
+        cprob, invCprob, cwCount = getPairStats(entity, string, stage)
+    newLinkStore[(entity, string)] = (cprob, invCprob, cwCount)
 
-    print('{}\t{}\t{}\t{}\t{}\t{}\t{}'.format(
-        entity,
-        string,
-        1 if correct else 0,
-        cprob,
-        invCprob,
-        cwCount,
-        tupleCount,
-      ),
-      file=linkStatsFile,
-      flush=True
-    )
+    printLinkStatsRow(linkStatsFile, entity, string, correct, cprob, invCprob,
+      cwCount, tupleCount)
+
+  saveLinkStore(dbVersion, newLinkStore)
+  metrics.writeMetrics()
+
+def readLinkStoreFile(linkStoreFile):
+  """Reads the store of Crosswikis results written by getLinkStats().
+
+  Args:
+    linkStoreFile: A file whose first line is the database version, followed
+      by lines of the form {entity}{TAB}{string}{TAB}{cprob}{TAB}{invCprob}
+      {TAB}{cwCount}.
+
+  Returns: A (dbVersion, linkStore) tuple, where linkStore is a dict mapping
+    (entity, string) pairs to (cprob, invCprob, cwCount) tuples. The values are
+    kept as the strings they were written as, so the rows printed from the
+    store match the rows printed from fresh results.
+  """
+  dbVersion = next(linkStoreFile).rstrip('\n')
+  linkStore = {}
+  for line in linkStoreFile:
+    entity, string, cprob, invCprob, cwCount = line.rstrip('\n').split('\t')
+    linkStore[(entity, string)] = (cprob, invCprob, cwCount)
+  return dbVersion, linkStore
+
+def writeLinkStoreFile(linkStoreFile, dbVersion, linkStore):
+  """Writes a store of Crosswikis results that readLinkStoreFile() can read."""
+  print(dbVersion, file=linkStoreFile)
+  for (entity, string), (cprob, invCprob, cwCount) in linkStore.items():
+    print('{}\t{}\t{}\t{}\t{}'.format(entity, string, cprob, invCprob,
+      cwCount), file=linkStoreFile)
+
+def loadLinkStore(dbVersion):
+  """Loads the store at LINK_STORE_PATH if it's from the given database version.
+
+  Returns: The linkStore dict from readLinkStoreFile(), or an empty dict if
+    there's no store for the version.
+  """
+  if not os.path.exists(LINK_STORE_PATH):
+    return {}
+  with open(LINK_STORE_PATH) as linkStoreFile:
+    storeVersion, linkStore = readLinkStoreFile(linkStoreFile)
+  return linkStore if storeVersion == dbVersion else {}
+
+def saveLinkStore(dbVersion, linkStore):
+  """Replaces the store at LINK_STORE_PATH."""
+  tempStorePath = LINK_STORE_PATH + '.tmp'
+  with open(tempStorePath, 'w') as linkStoreFile:
+    writeLinkStoreFile(linkStoreFile, dbVersion, linkStore)
+  os.replace(tempStorePath, LINK_STORE_PATH)
+
+def invalidateLinkStore(changedAnchors, changedEntities, oldDbVersion):
+  """Drops the stored results of pairs that changed in an update of Crosswikis.
+
+  The rest of the store is marked as current with the updated database, so the
+  next incremental getLinkStats() only queries the pairs that were dropped.
+
+  Args:
+    changedAnchors: The anchors whose rows changed, from update_crosswikis.py.
+    changedEntities: The entities whose rows changed.
+    oldDbVersion: cw.getDbVersion() from before the update. A store from any
+      other version is left alone, since it's out of date anyway.
+  """
+  if not os.path.exists(LINK_STORE_PATH):
+    return
+  with open(LINK_STORE_PATH) as linkStoreFile:
+    storeVersion, linkStore = readLinkStoreFile(linkStoreFile)
+  if storeVersion != oldDbVersion:
+    return
+  foldKey = lambda string: string.translate(cw.ASCII_CASE_FOLD)
+  changedKeys = set([foldKey(anchor) for anchor in changedAnchors])
+  linkStore = {
+    (entity, string): stats for ((entity, string), stats) in linkStore.items()
+    if entity not in changedEntities and foldKey(string) not in changedKeys
+  }
+  saveLinkStore(cw.getDbVersion(), linkStore)
 
 def linkStringToEntity(string, cprobThreshold=0.9, countThreshold=1000,
     tupleThreshold=500):
@@ -114,20 +277,172 @@ def linkStringToEntity(string, cprobThreshold=0.9, countThreshold=1000,
       want.
     countThreshold: The minimum count of the entity we want.
 
+  If the anchor feature table has been built, the string's top entities are read
+  from it, and its full distribution is only fetched when an entity past them
+  could still pass the thresholds.
+
   Returns: The most likely entity given the string, or None if no entity was
     found with high enough threshold.
   """
-  entityDistribution = cw.getEntityDistribution(
-    string,
-    table='crosswikis_subset'
-  )
+  table = 'crosswikis_subset'
+  if cw.hasTable(cw.getFeaturesTable(table)):
+    features = cw.getAnchorFeatures(string, table=table)
+    if features is None:
+      return None
+    topEntities = features['topEntities']
+    # The entities past the top ones have lower cprobs.
+    if (len(topEntities) == features['numEntities']
+        or topEntities[-1][1] <= cprobThreshold):
+      return pickLinkedEntity(topEntities, cprobThreshold, countThreshold)
+  entityDistribution = cw.getEntityDistribution(string, table=table)
+  return pickLinkedEntity(entityDistribution, cprobThreshold, countThreshold)
+
+def pickLinkedEntity(entityDistribution, cprobThreshold=0.9,
+    countThreshold=1000):
+  """Picks the most likely entity in a distribution that passes the thresholds.
+
+  Args:
+    entityDistribution: A list of (entity, cprob, num, denom) tuples from
+      crosswikis.getEntityDistribution().
+    cprobThreshold: The minimum probability of the entity given the string we
+      want.
+    countThreshold: The minimum count of the entity we want.
+
+  Returns: The (entity, cprob, num, denom) tuple of the entity, or None if no
+    entity was found with high enough threshold.
+  """
   entityDistribution = [
-    (ent, num, denom, cprob) for (ent, num, denom, cprob) in entityDistribution
+    (ent, cprob, num, denom) for (ent, cprob, num, denom) in entityDistribution
     if cprob > cprobThreshold and num > countThreshold
   ]
 
   return entityDistribution[0] if len(entityDistribution) > 0 else None
 
+def foldStringCounts(stringCounts):
+  """Lower-cases the strings of a dict from readStringCountsFile().
+
+  Returns: A dict mapping lower-cased strings to the sum of the Open IE tuple
+    counts of the strings that lower-case to them.
+  """
+  foldedCounts = {}
+  for string, count in stringCounts.items():
+    myutils.addToDict(foldedCounts, string.lower(), count)
+  return foldedCounts
+
+def filterLinks(distributions, cprobThreshold, countThreshold, tupleThreshold,
+    stringCounts):
+  """Applies the thresholds of runExperiment() to a batch of distributions.
+
+  Args:
+    distributions: A list of (anchor, entityDistribution) tuples from
+      crosswikis.iterAnchorDistributions().
+    cprobThreshold: The minimum p(entity|string).
+    countThreshold: The minimum count of the (entity, string) link.
+    tupleThreshold: The minimum number of Open IE tuples the string appears in.
+    stringCounts: A dict from foldStringCounts(), or None to skip the tuple
+      count threshold.
+
+  Returns: A list of the (entity, anchor) pairs that pass the thresholds.
+  """
+  links = [
+    (entity, anchor, cprob, num)
+    for (anchor, entityDistribution) in distributions
+    for (entity, cprob, num, denom) in entityDistribution
+  ]
+  if len(links) == 0:
+    return []
+  entities, anchors, cprobs, nums = zip(*links)
+  passed = np.array(cprobs) > cprobThreshold
+  passed &= np.array(nums, dtype=np.int64) > countThreshold
+  if stringCounts is not None:
+    tupleCounts = np.array([
+      stringCounts.get(anchor, 0) for (anchor, entityDistribution) in
+      distributions
+    ], dtype=np.int64)
+    anchorIndices = np.repeat(np.arange(len(distributions)), [
+      len(entityDistribution) for (anchor, entityDistribution) in distributions
+    ])
+    passed &= tupleCounts[anchorIndices] > tupleThreshold
+  return [(entities[i], anchors[i]) for i in np.flatnonzero(passed).tolist()]
+
+def getShardLinks(table, lowAnchor, highAnchor, runDir, cprobThreshold,
+    countThreshold, tupleThreshold, stringCounts):
+  """Links every anchor in one shard of a table to its entities.
+
+  Applies the same thresholds as runExperiment() to the entity distributions of
+  batches of anchors, and spills the surviving (entity, anchor) pairs to sorted
+  runs on disk.
+
+  Args:
+    table: The table to scan.
+    lowAnchor: The lowest anchor in the shard, or None.
+    highAnchor: The anchor after the end of the shard, or None.
+    runDir: The directory to spill sorted runs to.
+    cprobThreshold: The minimum p(entity|string).
+    countThreshold: The minimum count of the (entity, string) link.
+    tupleThreshold: The minimum number of Open IE tuples the string appears in.
+    stringCounts: A dict from foldStringCounts(), or None to skip the tuple
+      count threshold.
+
+  Returns: A list of paths to the sorted runs that were written.
+  """
+  def iterLinkKeys():
+    distributions = cw.iterAnchorDistributions(table, lowAnchor, highAnchor)
+    batch = list(itertools.islice(distributions, CORPUS_BATCH_SIZE))
+    while len(batch) > 0:
+      links = filterLinks(batch, cprobThreshold, countThreshold,
+        tupleThreshold, stringCounts)
+      for entity, anchor in links:
+        yield '{}\t{}'.format(entity, anchor)
+      batch = list(itertools.islice(distributions, CORPUS_BATCH_SIZE))
+
+  return myutils.countWithSpill(iterLinkKeys(), runDir, CORPUS_SPILL_MAX_KEYS)
+
+def getCorpusSynonymSets(cprobThreshold=0.9, countThreshold=1000,
+    tupleThreshold=500, stringCounts=None, numShards=1,
+    table='crosswikis_subset'):
+  """Generates synonym sets for every anchor in Crosswikis.
+
+  Unlike linkStringToEntity(), which runs one query per string, this scans the
+  table once, split into anchor ranges that are processed in parallel. Each
+  entity's synonyms are streamed to CORPUS_SYNSETS_OUTPUT_PATH, one line per
+  entity of the form {entity}{TAB}{synonym1}{TAB}{synonym2}..., sorted by
+  entity.
+
+  Args:
+    cprobThreshold: The minimum p(entity|string).
+    countThreshold: The minimum count of the (entity, string) link.
+    tupleThreshold: The minimum number of Open IE tuples the string appears in.
+    stringCounts: A dict from readStringCountsFile(), or None to skip the tuple
+      count threshold. The counts of strings that only differ in case are
+      added up, since anchors are aggregated ignoring case.
+    numShards: The number of processes to scan the table with.
+    table: The table to scan.
+  """
+  if stringCounts is not None:
+    stringCounts = foldStringCounts(stringCounts)
+  runDir = tempfile.mkdtemp(dir=constants.RESULTS_PATH)
+  shardArgs = [
+    (table, lowAnchor, highAnchor, runDir, cprobThreshold, countThreshold,
+      tupleThreshold, stringCounts)
+    for (lowAnchor, highAnchor) in cw.getAnchorShardBounds(table, numShards)
+  ]
+  if numShards > 1:
+    with multiprocessing.Pool(numShards) as pool:
+      runPathLists = pool.starmap(getShardLinks, shardArgs)
+  else:
+    runPathLists = [getShardLinks(*args) for args in shardArgs]
+
+  runPaths = [runPath for runPathList in runPathLists for runPath in runPathList]
+  links = (
+    key.split('\t') for (key, count) in myutils.mergeSortedRuns(runPaths)
+  )
+  with open(CORPUS_SYNSETS_OUTPUT_PATH, 'w') as synsetsFile:
+    for entity, group in itertools.groupby(links, key=lambda link: link[0]):
+      synonyms = [synonym for (entity, synonym) in group]
+      print('\t'.join([entity] + synonyms), file=synsetsFile)
+  shutil.rmtree(runDir)
+
 def readLinkStatsFile(linkStatsFile):
   """Reads the link stats file and returns a list of tuples with its contents.
 
@@ -178,6 +493,9 @@ def tryThresholds():
 
   Outputs the synonym sets generated to a file according to runExperiment().
 
+  Each line of the output also has bootstrap confidence intervals for the
+  precision, recall and F1, from bootstrap.getThresholdIntervals().
+
   Returns: a list of tuples of the form (cprobThreshold, countThreshold,
     tupleThreshold, precision, recall).
   """
@@ -186,23 +504,29 @@ def tryThresholds():
   prOutputFile = open(PR_OUTPUT_PATH, 'w')
   synsetsFile = open(SYNSETS_OUTPUT_PATH, 'w')
 
-  cprobThresholds = [x/100 for x in range(0, 100, 5)]
-  countThresholds = [10, 100, 500, 1000, 1500, 2000, 4000, 10000]
-  tupleThresholds = range(10, 2000, 100)
+  thresholds = [
+    (p, c, t)
+    for p in CPROB_THRESHOLDS
+    for c in COUNT_THRESHOLDS
+    for t in TUPLE_THRESHOLDS
+  ]
+  intervals = bootstrap.getThresholdIntervals(linkStats, thresholds,
+    seed=bootstrap.SEED)
   results = []
+  stage = metrics.startStage('try_thresholds', total=len(thresholds))
 
-  for p in cprobThresholds:
-    for c in countThresholds:
-      for t in tupleThresholds:
-        print('p={}, c={}, t={}'.format(p, c, t))
-        precision, recall, synset = runExperiment(linkStats, p, c, t)
+  for (p, c, t), interval in zip(thresholds, intervals):
+    precision, recall, synset = runExperiment(linkStats, p, c, t)
+    metrics.recordItem(stage)
 
-        print('{}\t{}\t{}\t{}\t{}'.format(p, c, t, precision, recall),
-          file=prOutputFile,
-          flush=True
-        )
-        results.append((p, c, t, precision, recall))
+    print('\t'.join([str(value) for value in
+        (p, c, t, precision, recall) + tuple(interval)]),
+      file=prOutputFile,
+      flush=True
+    )
+    results.append((p, c, t, precision, recall))
 
+  metrics.writeMetrics()
   return results
 
 def readPrFile(prFile):
@@ -247,5 +571,9 @@ def main():
 
   dedupePr()
 
+  # Step 3: generate synonym sets for the whole corpus with the tuned
+  # thresholds.
+#  getCorpusSynonymSets(numShards=multiprocessing.cpu_count())
+
 if __name__ == '__main__':
   main()
@@ -0,0 +1,148 @@
+# Assigns compact integer IDs to entities and case-folded anchors, so
+# intermediate files can hold packed ints instead of strings. The ID maps are
+# persisted as TSV files next to the Crosswikis database, with backslashes,
+# tabs and line breaks in the strings escaped, and strings are only looked up
+# again at report time. So far only the Open IE entity link distribution is
+# written with IDs (see get_openie_links.writeFbidDistributionIds()); the other
+# intermediate files are still string TSVs.
+#
+# IDs are only ever appended, so IDs already written to intermediate files stay
+# valid when new strings are interned. Build the maps from the Crosswikis tables
+# with build_crosswikis.py.
+
+import array
+import constants
+import os
+import re
+
+ENTITY_IDS_PATH = constants.DATA_PATH + 'google-crosswikis/entity-ids.tsv'
+ANCHOR_IDS_PATH = constants.DATA_PATH + 'google-crosswikis/anchor-ids.tsv'
+
+# How the characters that would break a line of an ID file are escaped.
+ESCAPES = {'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'}
+UNESCAPES = dict([(escape[1], char) for (char, escape) in ESCAPES.items()])
+
+def newIdMap():
+  """Creates an empty ID map.
+
+  Returns: A (stringToId, idToString) tuple, where stringToId is a dict mapping
+    strings to their IDs and idToString is a list indexed by ID.
+  """
+  return ({}, [])
+
+def internString(idMap, string):
+  """Gets the ID of the string, assigning the next free ID if it has none.
+
+  Args:
+    idMap: A (stringToId, idToString) tuple from newIdMap() or readIdMap().
+    string: The string to intern.
+
+  Returns: The integer ID of the string.
+  """
+  stringToId, idToString = idMap
+  if string in stringToId:
+    return stringToId[string]
+  stringId = len(idToString)
+  stringToId[string] = stringId
+  idToString.append(string)
+  return stringId
+
+def internAnchor(idMap, anchor):
+  """Interns an anchor, ignoring case like the rest of the pipeline does."""
+  return internString(idMap, anchor.lower())
+
+def lookupId(idMap, string):
+  """Gets the ID of the string without assigning a new one.
+
+  Returns: The integer ID of the string, or None if it has no ID.
+  """
+  return idMap[0].get(string)
+
+def lookupString(idMap, stringId):
+  """Gets the string that was assigned the given ID."""
+  return idMap[1][stringId]
+
+def escapeString(string):
+  """Escapes the backslashes, tabs and line breaks in a string."""
+  return re.sub(r'[\\\t\n\r]', lambda match: ESCAPES[match.group(0)], string)
+
+def unescapeString(string):
+  """Undoes escapeString()."""
+  return re.sub(r'\\(.)', lambda match: UNESCAPES[match.group(1)], string)
+
+def readIdMap(idFile):
+  """Reads an ID map written by writeIdMap().
+
+  Args:
+    idFile: A file with lines of the form {id}{TAB}{string}, in order of ID,
+      where the string is escaped with escapeString().
+
+  Returns: A (stringToId, idToString) tuple.
+  """
+  idMap = newIdMap()
+  for line in idFile:
+    stringId, string = line.rstrip('\n').split('\t', 1)
+    if internString(idMap, unescapeString(string)) != int(stringId):
+      raise ValueError('ID file is out of order at ID {}'.format(stringId))
+  return idMap
+
+def writeIdMap(idMap, idFile):
+  """Writes the ID map to a file, one {id}{TAB}{string} line per ID, with the
+  string escaped with escapeString()."""
+  for stringId, string in enumerate(idMap[1]):
+    print('{}\t{}'.format(stringId, escapeString(string)), file=idFile)
+
+def writeIdArray(values, idArrayFile):
+  """Writes a sequence of integer IDs or counts as a packed binary array.
+
+  Args:
+    values: An iterable of ints.
+    idArrayFile: A file opened in binary mode.
+  """
+  array.array('q', values).tofile(idArrayFile)
+
+def readIdArray(idArrayFile):
+  """Reads a packed binary array written by writeIdArray().
+
+  Args:
+    idArrayFile: A file opened in binary mode.
+
+  Returns: An array.array of ints.
+  """
+  values = array.array('q')
+  values.frombytes(idArrayFile.read())
+  return values
+
+def loadIdMap(path):
+  """Loads a persisted ID map, or an empty one if it hasn't been saved yet."""
+  if not os.path.exists(path):
+    return newIdMap()
+  with open(path) as idFile:
+    return readIdMap(idFile)
+
+def loadIdMaps():
+  """Loads the persisted entity and anchor ID maps.
+
+  Returns: An (entityIds, anchorIds) tuple of ID maps.
+  """
+  return loadIdMap(ENTITY_IDS_PATH), loadIdMap(ANCHOR_IDS_PATH)
+
+def saveIdMaps(entityIds, anchorIds):
+  """Persists the entity and anchor ID maps next to the database."""
+  with open(ENTITY_IDS_PATH, 'w') as entityIdsFile:
+    writeIdMap(entityIds, entityIdsFile)
+  with open(ANCHOR_IDS_PATH, 'w') as anchorIdsFile:
+    writeIdMap(anchorIds, anchorIdsFile)
+
+def buildIdMaps(rows, entityIds, anchorIds):
+  """Assigns IDs to every entity and case-folded anchor in some Crosswikis rows.
+
+  Args:
+    rows: An iterable of (anchor, entity) tuples, such as the rows of a
+      Crosswikis table.
+    entityIds: The entity ID map to intern the entities into.
+    anchorIds: The anchor ID map to intern the anchors into.
+  """
+  for anchor, entity in rows:
+    internAnchor(anchorIds, anchor)
+    internString(entityIds, entity)
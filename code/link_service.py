@@ -0,0 +1,196 @@
+# A long-running local HTTP service for linking strings to entities, so other
+# jobs can use get_synonym_sets.linkStringToEntity() without starting a script
+# per query.
+#
+# Concurrent requests are coalesced: they're queued, and a batcher thread looks
+# up every string that arrives within BATCH_WINDOW of the first in one call to
+# crosswikis.getEntityDistributions(). Database connections and recently looked
+# up distributions are kept between requests, and the distributions are dropped
+# when the database changes, e.g. with update_crosswikis.py.
+#
+# Endpoints:
+#   GET /link?string=Barack+Obama&k=5
+#     {"string": ..., "entity": <the entity linkStringToEntity() would pick, or
+#     null>, "entities": [{"entity", "cprob", "num", "denom"}, ... top k]}
+#   GET /stats
+#     Request and batch counts, throughput and p50/p99 latencies.
+#
+# Usage:
+#   python link_service.py [port]
+# and see link_service_load.py for benchmarking it.
+
+import collections
+import concurrent.futures
+import crosswikis
+import get_synonym_sets
+import http.server
+import json
+import metrics
+import queue
+import sys
+import threading
+import time
+import urllib.parse
+
+PORT = 8642
+TABLE = 'crosswikis_subset'
+
+# How long, in seconds, the batcher waits for more requests after the first.
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = crosswikis.MAX_BATCH_SIZE
+
+# How many strings' distributions to keep in memory.
+CACHE_SIZE = 100000
+
+DEFAULT_K = 5
+
+_requests = queue.Queue()
+requestStage = None
+batchStage = None
+
+def lookupBatch(strings, cache):
+  """Gets the entity distribution of each string, using the cache if possible.
+
+  Args:
+    strings: The strings to look up.
+    cache: An OrderedDict mapping strings to their distributions, in order of
+      last use.
+
+  Returns: A dict mapping each string to its distribution.
+  """
+  misses = [string for string in strings if string not in cache]
+  if len(misses) > 0:
+    cache.update(crosswikis.getEntityDistributions(misses, table=TABLE))
+  distributions = {}
+  for string in strings:
+    cache.move_to_end(string)
+    distributions[string] = cache[string]
+  while len(cache) > CACHE_SIZE:
+    cache.popitem(last=False)
+  return distributions
+
+def runBatcher(stage):
+  """Serves queued requests in batches, forever.
+
+  Args:
+    stage: The metrics stage to record each batch into.
+  """
+  cache = collections.OrderedDict()
+  cacheDbVersion = None
+  while True:
+    batch = [_requests.get()]
+    deadline = time.time() + BATCH_WINDOW
+    while len(batch) < MAX_BATCH_SIZE:
+      timeout = deadline - time.time()
+      if timeout <= 0:
+        break
+      try:
+        batch.append(_requests.get(timeout=timeout))
+      except queue.Empty:
+        break
+    metrics.setQueueDepth(stage, _requests.qsize())
+
+    strings = [string for (string, future) in batch]
+    try:
+      with metrics.timeItem(stage):
+        dbVersion = crosswikis.getDbVersion()
+        if dbVersion != cacheDbVersion:
+          cache.clear()
+          cacheDbVersion = dbVersion
+        distributions = lookupBatch(strings, cache)
+    except Exception as exception:
+      for string, future in batch:
+        future.set_exception(exception)
+      continue
+    for string, future in batch:
+      future.set_result(distributions[string])
+
+def getEntityDistribution(string):
+  """Queues a string for the batcher and waits for its distribution."""
+  future = concurrent.futures.Future()
+  _requests.put((string, future))
+  return future.result()
+
+def getStats():
+  stats = {}
+  for name, stage in [('requests', requestStage), ('batches', batchStage)]:
+    stats[name] = {
+      'count': stage['done'],
+      'errors': stage['errors'],
+      'perSecond': metrics.getThroughput(stage),
+      'p50LatencySeconds': metrics.getLatencyPercentile(stage, 50),
+      'p99LatencySeconds': metrics.getLatencyPercentile(stage, 99),
+    }
+  if batchStage['done'] > 0:
+    stats['meanBatchSize'] = requestStage['done'] / batchStage['done']
+  stats['queueDepth'] = _requests.qsize()
+  return stats
+
+class LinkRequestHandler(http.server.BaseHTTPRequestHandler):
+  def do_GET(self):
+    url = urllib.parse.urlparse(self.path)
+    params = urllib.parse.parse_qs(url.query)
+    if url.path == '/stats':
+      self.sendJson(200, getStats())
+    elif url.path == '/link' and 'string' in params:
+      try:
+        k = int(params.get('k', [DEFAULT_K])[0])
+      except ValueError:
+        k = -1
+      if k < 0:
+        self.sendJson(400, {'error': 'k must be a non-negative integer.'})
+        return
+      string = params['string'][0]
+      try:
+        # Failed lookups are recorded as errors by timeItem().
+        with metrics.timeItem(requestStage):
+          entityDistribution = getEntityDistribution(string)
+          linkedEntity = get_synonym_sets.pickLinkedEntity(entityDistribution)
+      except Exception as exception:
+        self.sendJson(500, {'error': 'Lookup failed: {}'.format(exception)})
+        return
+      self.sendJson(200, {
+        'string': string,
+        'entity': linkedEntity[0] if linkedEntity is not None else None,
+        'entities': [
+          {'entity': entity, 'cprob': cprob, 'num': num, 'denom': denom}
+          for (entity, cprob, num, denom) in entityDistribution[:k]
+        ],
+      })
+    else:
+      self.sendJson(404, {'error': 'Unknown request.'})
+
+  def sendJson(self, status, body):
+    content = json.dumps(body).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  def log_message(self, format, *args):
+    # Per-request logging is replaced by the stats endpoint and metrics file.
+    pass
+
+class LinkServer(http.server.ThreadingHTTPServer):
+  # Let bursts of concurrent clients queue instead of having their connections
+  # refused and retried.
+  request_queue_size = 1024
+  daemon_threads = True
+
+def main():
+  global requestStage, batchStage
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else PORT
+  crosswikis.KEEP_CONNECTIONS_OPEN = True
+  requestStage = metrics.startStage('link_requests')
+  batchStage = metrics.startStage('link_batches')
+  batcher = threading.Thread(target=runBatcher, args=(batchStage,),
+    daemon=True)
+  batcher.start()
+
+  server = LinkServer(('localhost', port), LinkRequestHandler)
+  print('Serving entity links on http://localhost:{}/'.format(port))
+  server.serve_forever()
+
+if __name__ == '__main__':
+  main()
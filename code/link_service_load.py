@@ -0,0 +1,77 @@
+# Load generator for link_service.py. Sends link requests for the strings in
+# the test set from several concurrent clients and reports the throughput and
+# latency it saw, along with the service's own stats.
+#
+# Usage:
+#   python link_service_load.py [--url URL] [--clients N] [--requests N]
+
+import argparse
+import concurrent.futures
+import get_synonym_sets
+import json
+import link_service
+import time
+import urllib.parse
+import urllib.request
+
+def getStrings(testSetFile):
+  """Gets the distinct strings in the test set."""
+  strings = set()
+  for line in testSetFile:
+    entity, string, correct = get_synonym_sets.parseTestSetLine(line)
+    strings.add(string)
+  return sorted(strings)
+
+def getJson(url):
+  with urllib.request.urlopen(url) as response:
+    return json.loads(response.read().decode('utf-8'))
+
+def sendRequests(baseUrl, strings, numRequests, offset, numClients):
+  """Sends every numClients'th request, starting at offset, one at a time.
+
+  Returns: A list of the latency of each request, in seconds.
+  """
+  latencies = []
+  for i in range(offset, numRequests, numClients):
+    url = '{}/link?{}'.format(
+      baseUrl,
+      urllib.parse.urlencode({'string': strings[i % len(strings)]})
+    )
+    startTime = time.time()
+    getJson(url)
+    latencies.append(time.time() - startTime)
+  return latencies
+
+def main():
+  parser = argparse.ArgumentParser(description='Benchmarks link_service.py.')
+  parser.add_argument('--url',
+    default='http://localhost:{}'.format(link_service.PORT))
+  parser.add_argument('--clients', type=int, default=32)
+  parser.add_argument('--requests', type=int, default=10000)
+  args = parser.parse_args()
+
+  strings = getStrings(open(get_synonym_sets.TEST_SET_PATH))
+  startTime = time.time()
+  with concurrent.futures.ThreadPoolExecutor(args.clients) as executor:
+    clientLatencies = executor.map(
+      lambda offset: sendRequests(args.url, strings, args.requests, offset,
+        args.clients),
+      range(args.clients)
+    )
+    latencies = sorted(
+      [latency for latencies in clientLatencies for latency in latencies]
+    )
+  elapsed = time.time() - startTime
+
+  print('Requests\tSeconds\tRequests/s\tp50 latency\tp99 latency')
+  print('{}\t{:.2f}\t{:.1f}\t{:.4f}\t{:.4f}'.format(
+    len(latencies),
+    elapsed,
+    len(latencies) / elapsed,
+    latencies[len(latencies) // 2],
+    latencies[min(len(latencies) - 1, len(latencies) * 99 // 100)]
+  ))
+  print(json.dumps(getJson(args.url + '/stats'), indent=2))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,196 @@
+# Builds the link stats file in one command, instead of running
+# get_openie_freqs.py and then get_synonym_sets.getLinkStats().
+#
+# Test set rows stream through three stages connected by bounded queues: the
+# Open IE tuple count of each string is fetched from the backend in a
+# subprocess, the Crosswikis stats of each (entity, string) pair are looked up
+# in a thread pool, and the rows are written out. The queues apply
+# backpressure, so the backend and the database are queried concurrently
+# without reading the whole test set ahead of them.
+#
+# The tuple counts and Crosswikis stats are the same as the two scripts produce,
+# and the Crosswikis stats are kept in the same link store, so the pipeline can
+# be run incrementally too. The rows are written in the order they finish, not
+# in test set order.
+
+import asyncio
+import concurrent.futures
+import crosswikis
+import get_synonym_sets
+import metrics
+import openie
+
+QUEUE_SIZE = 100
+NUM_OPENIE_WORKERS = 8
+NUM_CROSSWIKIS_WORKERS = 4
+
+# Strings in fewer Open IE tuples than this are left out of the link stats, as
+# in get_synonym_sets.getLinkStats().
+MIN_TUPLE_COUNT = 10
+
+async def getTupleCount(string):
+  """Gets the number of Open IE tuples the string is arg1 or arg2 of.
+
+  Like get_synonym_sets.readStringCountsFile(), only the count the backend
+  prints for the exact string is used.
+  """
+  tupleCount = 0
+  for argn in [1, 2]:
+    process = await asyncio.create_subprocess_shell(
+      openie.getCountsCommand(string, argn),
+      stdout=asyncio.subprocess.PIPE
+    )
+    output, _ = await process.communicate()
+    instanceCounts = openie.getNumInstances(output.decode('utf-8').splitlines())
+    tupleCount += instanceCounts.get(string, 0)
+  return tupleCount
+
+async def readTestSet(testSetFile, countQueue):
+  for line in testSetFile:
+    await countQueue.put(get_synonym_sets.parseTestSetLine(line))
+
+async def fetchCounts(countQueue, lookupQueue, tupleCounts, stage):
+  """Fetches tuple counts for test set rows until it gets a None.
+
+  Args:
+    countQueue: The queue of (entity, string, correct) tuples to read from.
+    lookupQueue: The queue to put (entity, string, correct, tupleCount) tuples
+      on.
+    tupleCounts: A dict shared by the workers, mapping strings to tasks that
+      fetch their counts, so each string is only fetched once.
+    stage: The metrics stage to record into.
+  """
+  while True:
+    item = await countQueue.get()
+    metrics.setQueueDepth(stage, countQueue.qsize())
+    if item is None:
+      break
+    entity, string, correct = item
+    if string not in tupleCounts:
+      tupleCounts[string] = asyncio.ensure_future(getTupleCount(string))
+    with metrics.timeItem(stage):
+      tupleCount = await tupleCounts[string]
+    if tupleCount >= MIN_TUPLE_COUNT:
+      await lookupQueue.put((entity, string, correct, tupleCount))
+
+async def lookupLinks(lookupQueue, outputQueue, executor, stage, linkStore,
+    newLinkStore):
+  """Looks up the Crosswikis stats of pairs until it gets a None.
+
+  Args:
+    lookupQueue: The queue of (entity, string, correct, tupleCount) tuples to
+      read from.
+    outputQueue: The queue to put complete link stats rows on.
+    executor: The thread pool to run the database queries in.
+    stage: The metrics stage to record into.
+    linkStore: A link store from get_synonym_sets.loadLinkStore(). Pairs in it
+      aren't looked up again.
+    newLinkStore: A dict to add the stats of every pair to, in the same form.
+  """
+  loop = asyncio.get_running_loop()
+  while True:
+    item = await lookupQueue.get()
+    metrics.setQueueDepth(stage, lookupQueue.qsize())
+    if item is None:
+      break
+    entity, string, correct, tupleCount = item
+    if (entity, string) in linkStore:
+      cprob, invCprob, cwCount = linkStore[(entity, string)]
+      metrics.recordItem(stage)
+    else:
+      with metrics.timeItem(stage):
+        cprob, invCprob, cwCount = await loop.run_in_executor(
+          executor, get_synonym_sets.getPairStats, entity, string, stage
+        )
+    newLinkStore[(entity, string)] = (cprob, invCprob, cwCount)
+    await outputQueue.put(
+      (entity, string, correct, cprob, invCprob, cwCount, tupleCount)
+    )
+
+async def runUntilFailure(tasks):
+  """Waits for every task, cancelling the rest as soon as one of them fails.
+
+  Without this, a stage that dies leaves the stages feeding it blocked on a
+  full queue forever.
+
+  Raises: The exception of the first task that failed.
+  """
+  done, pending = await asyncio.wait(tasks,
+    return_when=asyncio.FIRST_EXCEPTION)
+  for task in pending:
+    task.cancel()
+  await asyncio.gather(*pending, return_exceptions=True)
+  for task in done:
+    task.result()
+
+async def writeLinkStats(outputQueue, linkStatsFile):
+  get_synonym_sets.printLinkStatsHeader(linkStatsFile)
+  while True:
+    row = await outputQueue.get()
+    if row is None:
+      break
+    get_synonym_sets.printLinkStatsRow(linkStatsFile, *row)
+
+async def buildLinkStats(testSetFile, linkStatsFile, incremental=True):
+  """Runs the pipeline from a test set file to a link stats file.
+
+  The rows are written in the order they finish, not in test set order. The
+  link store is updated like in get_synonym_sets.getLinkStats().
+
+  Args:
+    testSetFile: The test set file.
+    linkStatsFile: The file to write the link stats to.
+    incremental: If false, every pair is looked up again.
+  """
+  dbVersion = crosswikis.getDbVersion()
+  linkStore = get_synonym_sets.loadLinkStore(dbVersion) if incremental else {}
+  newLinkStore = {}
+  countQueue = asyncio.Queue(QUEUE_SIZE)
+  lookupQueue = asyncio.Queue(QUEUE_SIZE)
+  outputQueue = asyncio.Queue(QUEUE_SIZE)
+  countStage = metrics.startStage('openie_counts')
+  lookupStage = metrics.startStage('crosswikis_lookup')
+  tupleCounts = {}
+
+  writer = asyncio.ensure_future(writeLinkStats(outputQueue, linkStatsFile))
+  executor = concurrent.futures.ThreadPoolExecutor(NUM_CROSSWIKIS_WORKERS)
+  with executor:
+    lookupWorkers = [
+      asyncio.ensure_future(
+        lookupLinks(lookupQueue, outputQueue, executor, lookupStage,
+          linkStore, newLinkStore)
+      )
+      for i in range(NUM_CROSSWIKIS_WORKERS)
+    ]
+    countWorkers = [
+      asyncio.ensure_future(
+        fetchCounts(countQueue, lookupQueue, tupleCounts, countStage)
+      )
+      for i in range(NUM_OPENIE_WORKERS)
+    ]
+
+    # Each stage is shut down with one None per worker once the stage before
+    # it has finished.
+    async def feedStages():
+      await readTestSet(testSetFile, countQueue)
+      for worker in countWorkers:
+        await countQueue.put(None)
+      await asyncio.gather(*countWorkers)
+      for worker in lookupWorkers:
+        await lookupQueue.put(None)
+      await asyncio.gather(*lookupWorkers)
+      await outputQueue.put(None)
+    await runUntilFailure(
+      [asyncio.ensure_future(feedStages()), writer]
+        + countWorkers + lookupWorkers
+    )
+  get_synonym_sets.saveLinkStore(dbVersion, newLinkStore)
+
+def main():
+  testSetFile = open(get_synonym_sets.TEST_SET_PATH)
+  linkStatsFile = open(get_synonym_sets.LINK_STATS_PATH, 'w')
+  asyncio.run(buildLinkStats(testSetFile, linkStatsFile))
+  metrics.writeMetrics()
+
+if __name__ == '__main__':
+  main()
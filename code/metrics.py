@@ -0,0 +1,245 @@
+# Tracks progress and throughput of the long-running drivers. Each stage of a
+# driver records its items here instead of printing a line per item. A
+# background thread periodically writes the metrics to a textfile in the
+# Prometheus exposition format (e.g. for node_exporter's textfile collector),
+# along with a one-line summary per stage on stdout. Each driver writes its own
+# file, named after its script, so drivers running at the same time don't
+# replace each other's stages.
+#
+# Usage:
+#   stage = metrics.startStage('link_stats', total=len(lines))
+#   for line in lines:
+#     with metrics.timeItem(stage):
+#       ...
+#   metrics.writeMetrics()
+
+import collections
+import constants
+import contextlib
+import os
+import re
+import sys
+import threading
+import time
+
+METRICS_PATH = constants.RESULTS_PATH + 'metrics-{driver}.prom'
+
+# How often, in seconds, to write the metrics file while stages are running.
+WRITE_INTERVAL = 10
+
+# How many of the most recent latencies to compute percentiles over.
+NUM_LATENCY_SAMPLES = 10000
+
+LATENCY_PERCENTILES = [50, 90, 99]
+
+_stages = collections.OrderedDict()
+_lock = threading.RLock()
+_writeLock = threading.Lock()
+_writerThread = None
+
+def startStage(name, total=None):
+  """Starts tracking a stage, replacing any earlier stage with the same name.
+
+  Args:
+    name: The name of the stage, used as a label in the metrics file.
+    total: The number of items the stage will process, if known, for the ETA.
+
+  Returns: The stage, to pass to the other functions in this module.
+  """
+  stage = {
+    'name': name,
+    'total': total,
+    'done': 0,
+    'errors': 0,
+    'queueDepth': 0,
+    'startTime': time.time(),
+    'latencies': collections.deque(maxlen=NUM_LATENCY_SAMPLES),
+    'latencySum': 0,
+    'latencyCount': 0,
+  }
+  with _lock:
+    _stages[name] = stage
+  startWriter()
+  return stage
+
+def recordItem(stage, latency=None, error=False):
+  """Records that the stage finished an item.
+
+  Args:
+    stage: The stage from startStage().
+    latency: How long the item took, in seconds, if it was timed.
+    error: Whether the item failed.
+  """
+  with _lock:
+    stage['done'] += 1
+    if error:
+      stage['errors'] += 1
+    if latency is not None:
+      stage['latencies'].append(latency)
+      stage['latencySum'] += latency
+      stage['latencyCount'] += 1
+
+def recordError(stage):
+  """Records an error in an item the stage is working on, without finishing it.
+
+  Use this for problems that don't stop the item, which is still recorded with
+  recordItem() or timeItem().
+  """
+  with _lock:
+    stage['errors'] += 1
+
+@contextlib.contextmanager
+def timeItem(stage):
+  """Times the body of a with statement as one item of the stage.
+
+  Exceptions are recorded as errors and re-raised.
+  """
+  startTime = time.time()
+  try:
+    yield
+  except Exception:
+    recordItem(stage, time.time() - startTime, error=True)
+    raise
+  recordItem(stage, time.time() - startTime)
+
+def setQueueDepth(stage, queueDepth):
+  """Records how many items are waiting to be processed by the stage."""
+  with _lock:
+    stage['queueDepth'] = queueDepth
+
+def getThroughput(stage):
+  """Gets the number of items the stage has finished per second."""
+  elapsed = time.time() - stage['startTime']
+  return stage['done'] / elapsed if elapsed > 0 else 0
+
+def getEta(stage):
+  """Gets the estimated number of seconds left, or None if it isn't known."""
+  throughput = getThroughput(stage)
+  if stage['total'] is None or throughput == 0:
+    return None
+  return max(0, stage['total'] - stage['done']) / throughput
+
+def getLatencyPercentile(stage, percentile):
+  """Gets a percentile of the stage's recent latencies, or None if unknown."""
+  with _lock:
+    latencies = sorted(stage['latencies'])
+  if len(latencies) == 0:
+    return None
+  index = min(len(latencies) - 1, int(len(latencies) * percentile / 100))
+  return latencies[index]
+
+def formatMetrics():
+  """Formats the metrics of every stage in the Prometheus text format."""
+  lines = []
+  def addMetric(name, help, type, values):
+    lines.append('# HELP synonym_eval_{} {}'.format(name, help))
+    lines.append('# TYPE synonym_eval_{} {}'.format(name, type))
+    for labels, value in values:
+      if value is None:
+        continue
+      labelString = ','.join(
+        ['{}="{}"'.format(key, labelValue) for (key, labelValue) in labels]
+      )
+      lines.append(
+        'synonym_eval_{}{{{}}} {}'.format(name, labelString, value)
+      )
+
+  with _lock:
+    stages = list(_stages.values())
+    addMetric('items_total', 'Items finished by the stage.', 'counter',
+      [([('stage', stage['name'])], stage['done']) for stage in stages])
+    addMetric('errors_total', 'Errors in the stage\'s items.', 'counter',
+      [([('stage', stage['name'])], stage['errors']) for stage in stages])
+    addMetric('items_expected', 'Items the stage will process.', 'gauge',
+      [([('stage', stage['name'])], stage['total']) for stage in stages])
+    addMetric('queue_depth', 'Items waiting to be processed.', 'gauge',
+      [([('stage', stage['name'])], stage['queueDepth']) for stage in stages])
+    addMetric('items_per_second', 'Throughput since the stage started.',
+      'gauge', [
+        ([('stage', stage['name'])], getThroughput(stage))
+        for stage in stages
+      ])
+    addMetric('eta_seconds', 'Estimated time until the stage finishes.',
+      'gauge',
+      [([('stage', stage['name'])], getEta(stage)) for stage in stages])
+    addMetric('latency_seconds', 'Recent per-item latency percentiles.',
+      'summary', [
+        ([('stage', stage['name']), ('quantile', percentile / 100)],
+          getLatencyPercentile(stage, percentile))
+        for stage in stages
+        for percentile in LATENCY_PERCENTILES
+      ])
+    for stage in stages:
+      lines.append('synonym_eval_latency_seconds_sum{{stage="{}"}} {}'.format(
+        stage['name'], stage['latencySum']))
+      lines.append(
+        'synonym_eval_latency_seconds_count{{stage="{}"}} {}'.format(
+          stage['name'], stage['latencyCount'])
+      )
+  return '\n'.join(lines) + '\n'
+
+def formatSummary(stage):
+  """Formats a one-line human-readable summary of the stage's progress."""
+  total = '?' if stage['total'] is None else stage['total']
+  eta = getEta(stage)
+  p50 = getLatencyPercentile(stage, 50)
+  return (
+    '{name}: {done}/{total} items, {rate:.1f}/s, ETA {eta}, {errors} errors, '
+    'p50 latency {p50}'
+  ).format(
+    name=stage['name'],
+    done=stage['done'],
+    total=total,
+    rate=getThroughput(stage),
+    eta='?' if eta is None else '{:.0f}s'.format(eta),
+    errors=stage['errors'],
+    p50='?' if p50 is None else '{:.3f}s'.format(p50)
+  )
+
+def getMetricsPath():
+  """Gets the metrics file of the running driver, named after its script."""
+  driver = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+  if re.fullmatch(r'\w+', driver) is None:
+    driver = 'python'
+  return METRICS_PATH.format(driver=driver)
+
+def writeMetrics(path=None):
+  """Writes the metrics file and prints a summary line for each stage.
+
+  The file is replaced atomically, so a scraper never reads a partial file.
+
+  Args:
+    path: The file to write, getMetricsPath() by default.
+  """
+  if path is None:
+    path = getMetricsPath()
+  with _writeLock:
+    tempPath = path + '.tmp'
+    with open(tempPath, 'w') as metricsFile:
+      metricsFile.write(formatMetrics())
+    os.replace(tempPath, path)
+    with _lock:
+      summaries = [formatSummary(stage) for stage in _stages.values()]
+    for summary in summaries:
+      print(summary)
+
+def runWriter():
+  """Writes the metrics every WRITE_INTERVAL seconds."""
+  while True:
+    time.sleep(WRITE_INTERVAL)
+    try:
+      writeMetrics()
+    except OSError as e:
+      print('Couldn\'t write the metrics: {}'.format(e))
+
+def startWriter():
+  """Starts the thread that writes the metrics, if it isn't running yet.
+
+  Recording items never writes or prints anything itself, so the drivers' loops
+  and the link service's requests don't wait on the file.
+  """
+  global _writerThread
+  with _lock:
+    if _writerThread is None:
+      _writerThread = threading.Thread(target=runWriter, daemon=True)
+      _writerThread.start()
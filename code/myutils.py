@@ -1,3 +1,8 @@
+import heapq
+import itertools
+import os
+import tempfile
+
 def addToDictWithFn(dict, key, value, addFunction):
   if key in dict:
     dict[key] = addFunction(dict[key], value)
@@ -6,3 +11,116 @@ def addToDictWithFn(dict, key, value, addFunction):
 
 def addToDict(dict, key, num):
   addToDictWithFn(dict, key, num, lambda x, y: x+y)
+
+def getByteRanges(path, numChunks):
+  """Splits a file into roughly equal (start, end) byte ranges.
+
+  Use readLinesInRange() to read the lines of each range; every line of the file
+  is read by exactly one range.
+  """
+  size = os.path.getsize(path)
+  chunkSize = max(1, -(-size // numChunks))
+  return [
+    (start, min(start + chunkSize, size))
+    for start in range(0, size, chunkSize)
+  ]
+
+def readLinesInRange(path, start, end):
+  """Yields the lines of a file that begin in the byte range [start, end)."""
+  with open(path, 'rb') as rangeFile:
+    if start > 0:
+      # Skip the rest of the line that straddles the start of the range.
+      rangeFile.seek(start - 1)
+      rangeFile.readline()
+    while rangeFile.tell() < end:
+      line = rangeFile.readline()
+      if not line:
+        break
+      yield line.decode('utf-8')
+
+def writeSortedRun(counts, runDir):
+  """Writes a dict of counts to a new file in runDir, sorted by key.
+
+  Keys are strings and may contain tabs. Returns the path of the run file.
+  """
+  runFd, runPath = tempfile.mkstemp(suffix='.run', dir=runDir)
+  with os.fdopen(runFd, 'w') as runFile:
+    for key in sorted(counts):
+      print('{}\t{}'.format(key, counts[key]), file=runFile)
+  return runPath
+
+def readSortedRun(runPath):
+  """Yields (key, count) tuples from a run written by writeSortedRun()."""
+  with open(runPath) as runFile:
+    for line in runFile:
+      key, count = line.rstrip('\n').rsplit('\t', 1)
+      yield key, int(count)
+
+def countWithSpill(keys, runDir, maxKeys):
+  """Counts the keys, spilling sorted runs to disk to bound memory.
+
+  Args:
+    keys: An iterable of string keys. Each occurrence counts once.
+    runDir: The directory to write sorted runs to.
+    maxKeys: The most distinct keys to hold in memory before spilling a run.
+
+  Returns: A list of run paths, to be combined with mergeSortedRuns().
+  """
+  counts = {}
+  runPaths = []
+  for key in keys:
+    addToDict(counts, key, 1)
+    if len(counts) >= maxKeys:
+      runPaths.append(writeSortedRun(counts, runDir))
+      counts = {}
+  if len(counts) > 0:
+    runPaths.append(writeSortedRun(counts, runDir))
+  return runPaths
+
+def mergeSortedRuns(runPaths):
+  """K-way merges sorted runs, adding up the counts of equal keys.
+
+  Yields: (key, count) tuples in sorted order of key.
+  """
+  runs = [readSortedRun(runPath) for runPath in runPaths]
+  merged = heapq.merge(*runs, key=lambda item: item[0])
+  for key, group in itertools.groupby(merged, key=lambda item: item[0]):
+    yield key, sum([count for (key, count) in group])
+
+def sortWithSpill(lines, runDir, maxLines):
+  """Sorts lines of text, spilling sorted runs to disk to bound memory.
+
+  Args:
+    lines: An iterable of strings without newlines.
+    runDir: The directory to write sorted runs to.
+    maxLines: The most lines to hold in memory before spilling a run.
+
+  Returns: A list of run paths, to be combined with mergeSortedLines().
+  """
+  buffer = []
+  runPaths = []
+  def spill():
+    runFd, runPath = tempfile.mkstemp(suffix='.run', dir=runDir)
+    with os.fdopen(runFd, 'w') as runFile:
+      for line in sorted(buffer):
+        print(line, file=runFile)
+    runPaths.append(runPath)
+    buffer.clear()
+  for line in lines:
+    buffer.append(line)
+    if len(buffer) >= maxLines:
+      spill()
+  if len(buffer) > 0:
+    spill()
+  return runPaths
+
+def mergeSortedLines(runPaths):
+  """K-way merges runs written by sortWithSpill().
+
+  Yields: Every line of the runs, without newlines, in sorted order.
+  """
+  runs = [
+    (line.rstrip('\n') for line in open(runPath))
+    for runPath in runPaths
+  ]
+  yield from heapq.merge(*runs)
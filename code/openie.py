@@ -1,26 +1,44 @@
 import constants
+import multiprocessing
 import myutils
 import os
+import shutil
+import tempfile
 
-def writeNumInstances(string, outputPath, arg1=True, arg2=True):
+# The most distinct strings a worker counts in memory before spilling a sorted
+# run to disk in writeBulkNumInstances().
+SPILL_MAX_KEYS = 1000000
+
+def getCountsCommand(string, argn):
+  """Gets the shell command that prints the Open IE tuple count of a string.
+
+  Args:
+    string: The string to count.
+    argn: 1 to count tuples with the string as arg1, or 2 for arg2.
+
+  Returns: The command. Its output has lines of the form {string}{TAB}{count}.
+  """
   command = (
     'java -jar {jarFile} --arg{argn} "{string}" --noInst --countsOnly '
     '| grep ".*	.*" '
-    '>> {outputPath}'
   )
+  return command.format(
+    jarFile=constants.OPENIE_BACKEND_JAR_PATH,
+    argn=argn,
+    string=string
+  )
+
+def writeNumInstances(string, outputPath, arg1=True, arg2=True):
+  command = '{countsCommand}>> {outputPath}'
   if arg1:
     arg1Command = command.format(
-      jarFile=constants.OPENIE_BACKEND_JAR_PATH,
-      argn=1,
-      string=string,
+      countsCommand=getCountsCommand(string, 1),
       outputPath=outputPath
     )
     os.system(arg1Command)
   if arg2:
     arg2Command = command.format(
-      jarFile=constants.OPENIE_BACKEND_JAR_PATH,
-      argn=2,
-      string=string,
+      countsCommand=getCountsCommand(string, 2),
       outputPath=outputPath
     )
     os.system(arg2Command)
@@ -33,3 +51,76 @@ def getNumInstances(instancesFile):
     count = int(lineParts[1])
     myutils.addToDict(instanceCounts, string, count)
   return instanceCounts
+
+def iterArgs(line, arg1=True, arg2=True):
+  """Yields the arg1 and/or arg2 of an extraction from the extractions dump."""
+  fields = line.rstrip('\n').split('\t')
+  if len(fields) < 3:
+    return
+  if arg1:
+    yield fields[0].strip()
+  if arg2:
+    yield fields[2].strip()
+
+def spillArgCountRange(dumpPath, byteRange, strings, runDir, maxKeys, arg1,
+    arg2):
+  """Counts the args in a byte range of the extractions dump.
+
+  Args:
+    dumpPath: The path of the extractions dump.
+    byteRange: A (start, end) tuple from myutils.getByteRanges().
+    strings: If not None, a set of the only strings to count.
+    runDir: The directory to spill sorted runs of partial counts to.
+    maxKeys: The most strings to hold in memory at once.
+    arg1: Whether to count arg1s.
+    arg2: Whether to count arg2s.
+
+  Returns: A list of paths to the sorted runs that were written.
+  """
+  start, end = byteRange
+  args = (
+    arg for line in myutils.readLinesInRange(dumpPath, start, end)
+    for arg in iterArgs(line, arg1, arg2)
+    if arg != '' and (strings is None or arg in strings)
+  )
+  return myutils.countWithSpill(args, runDir, maxKeys)
+
+def writeBulkNumInstances(outputPath, strings=None,
+    dumpPath=constants.OPENIE_EXTRACTIONS_PATH, arg1=True, arg2=True,
+    numWorkers=1, maxKeys=SPILL_MAX_KEYS):
+  """Counts the tuples of many strings in one pass over the extractions dump.
+
+  This computes the same counts as calling writeNumInstances() for each string,
+  without querying the backend. The dump is split into byte ranges that are
+  counted in parallel, and the partial counts are merged at the end.
+
+  Args:
+    outputPath: The file to write the counts to, in the format
+      getNumInstances() reads, sorted by string.
+    strings: If given, a set of the only strings to count. Otherwise, every
+      string is counted.
+    dumpPath: The path of the extractions dump.
+    arg1: Whether to count tuples with the string as arg1.
+    arg2: Whether to count tuples with the string as arg2.
+    numWorkers: The number of processes to count with.
+    maxKeys: The most strings each worker holds in memory.
+  """
+  if strings is not None:
+    strings = set(strings)
+  runDir = tempfile.mkdtemp(dir=os.path.dirname(outputPath))
+  byteRanges = myutils.getByteRanges(dumpPath, numWorkers)
+  spillArgs = [
+    (dumpPath, byteRange, strings, runDir, maxKeys, arg1, arg2)
+    for byteRange in byteRanges
+  ]
+  if numWorkers > 1:
+    with multiprocessing.Pool(numWorkers) as pool:
+      runPathLists = pool.starmap(spillArgCountRange, spillArgs)
+  else:
+    runPathLists = [spillArgCountRange(*args) for args in spillArgs]
+
+  runPaths = [runPath for runPathList in runPathLists for runPath in runPathList]
+  with open(outputPath, 'w') as outputFile:
+    for string, count in myutils.mergeSortedRuns(runPaths):
+      print('{}\t{}'.format(string, count), file=outputFile)
+  shutil.rmtree(runDir)
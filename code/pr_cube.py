@@ -0,0 +1,180 @@
+# Precomputes precision and recall for every combination of lower-bound
+# thresholds on the four link stats features (cprob, invCprob, cwCount and
+# tupleCount), so a threshold question doesn't need another sweep over the link
+# stats.
+#
+# The feature space is binned, and the cube holds a 4-d suffix sum of the
+# histogram of returned and correct rows. The count of rows above all four
+# thresholds is then a single lookup.
+#
+# Usage:
+#   python pr_cube.py build
+#   python pr_cube.py query --cprob 0.9 --count 1000 --tuples 500
+
+import argparse
+import get_synonym_sets
+import numpy as np
+
+CUBE_PATH = get_synonym_sets.MY_RESULTS_PATH + '1-link-stats-cube.npz'
+
+FEATURE_NAMES = ['cprob', 'invCprob', 'cwCount', 'tupleCount']
+
+# Bin edges used for the probabilities. The counts use quantiles of the data,
+# plus the thresholds get_synonym_sets.tryThresholds() sweeps, so those are
+# answered exactly.
+CPROB_EDGES = get_synonym_sets.CPROB_THRESHOLDS
+NUM_COUNT_EDGES = 64
+
+def getQuantileEdges(values, numEdges, extraEdges=[]):
+  """Gets up to numEdges distinct bin edges at evenly spaced quantiles, along
+  with extraEdges."""
+  quantiles = np.quantile(values, np.linspace(0, 1, numEdges))
+  return np.union1d(quantiles, extraEdges)
+
+def getSuffixSums(histogram):
+  """Sums the histogram from each cell to the end of every axis.
+
+  The result has an extra zero cell at the end of each axis, so that a bin
+  index one past the last edge means "no rows".
+  """
+  sums = histogram
+  for axis in range(histogram.ndim):
+    sums = np.flip(np.cumsum(np.flip(sums, axis), axis), axis)
+  return np.pad(sums, [(0, 1)] * histogram.ndim)
+
+def buildCube(linkStats, edges=None):
+  """Builds the PR cube from link stats.
+
+  Args:
+    linkStats: A list of link stats tuples from
+      get_synonym_sets.readLinkStatsFile().
+    edges: A list of four sorted arrays of bin edges, one per feature in the
+      order of FEATURE_NAMES. By default, CPROB_EDGES is used for the
+      probabilities, and quantiles of the data and the swept thresholds for the
+      counts.
+
+  Returns: A dict with the arrays of the cube, to save with saveCube().
+  """
+  isCorrect = np.array([line[2] for line in linkStats], dtype=bool)
+  features = [
+    np.array([line[column] for line in linkStats], dtype=np.float64)
+    for column in range(3, 7)
+  ]
+  if edges is None:
+    edges = [
+      CPROB_EDGES,
+      CPROB_EDGES,
+      getQuantileEdges(features[2], NUM_COUNT_EDGES,
+        get_synonym_sets.COUNT_THRESHOLDS),
+      getQuantileEdges(features[3], NUM_COUNT_EDGES,
+        get_synonym_sets.TUPLE_THRESHOLDS),
+    ]
+  edges = [np.asarray(featureEdges, dtype=np.float64) for featureEdges in edges]
+
+  # A row is in bin j of a feature if exactly j edges are below its value, so
+  # value > edges[k] exactly when its bin is at least k+1.
+  bins = [
+    np.searchsorted(featureEdges, values, side='left')
+    for (featureEdges, values) in zip(edges, features)
+  ]
+  shape = tuple(len(featureEdges) + 1 for featureEdges in edges)
+  cells = np.ravel_multi_index(bins, shape)
+  numCells = int(np.prod(shape))
+  returnedHistogram = np.bincount(cells, minlength=numCells).reshape(shape)
+  correctHistogram = np.bincount(
+    cells, weights=isCorrect, minlength=numCells
+  ).astype(np.int64).reshape(shape)
+
+  cube = {
+    'returned': getSuffixSums(returnedHistogram),
+    'correct': getSuffixSums(correctHistogram),
+    'totalCorrect': np.int64(isCorrect.sum()),
+  }
+  for name, featureEdges in zip(FEATURE_NAMES, edges):
+    cube[name + 'Edges'] = featureEdges
+  return cube
+
+def saveCube(cube, path=CUBE_PATH):
+  np.savez(path, **cube)
+
+def loadCube(path=CUBE_PATH):
+  with np.load(path) as cubeFile:
+    return {name: cubeFile[name] for name in cubeFile.files}
+
+def getPr(cube, cprob=None, invCprob=None, cwCount=None, tupleCount=None):
+  """Gets the precision and recall for a combination of thresholds.
+
+  Rows are returned if each feature is strictly greater than its threshold, as
+  in get_synonym_sets.runExperiment(). Thresholds that aren't bin edges are
+  rounded down to the nearest edge, and the edges that were actually used are
+  returned.
+
+  Args:
+    cube: A cube from buildCube() or loadCube().
+    cprob: The threshold on p(entity|string), or None for no threshold.
+    invCprob: The threshold on p(string|entity), or None for no threshold.
+    cwCount: The threshold on the Crosswikis count, or None for no threshold.
+    tupleCount: The threshold on the Open IE tuple count, or None for no
+      threshold.
+
+  Returns: A tuple of (precision, recall, returnedCount, correctCount,
+    thresholds), where precision is None if nothing was returned and thresholds
+    is the list of edges used, with None for features without a threshold.
+  """
+  index = []
+  usedThresholds = []
+  for name, threshold in zip(FEATURE_NAMES, [cprob, invCprob, cwCount,
+      tupleCount]):
+    featureEdges = cube[name + 'Edges']
+    numEdgesBelow = 0
+    if threshold is not None:
+      numEdgesBelow = np.searchsorted(featureEdges, threshold, side='right')
+    if numEdgesBelow == 0:
+      index.append(0)
+      usedThresholds.append(None)
+    else:
+      index.append(numEdgesBelow)
+      usedThresholds.append(float(featureEdges[numEdgesBelow - 1]))
+  index = tuple(index)
+
+  returnedCount = int(cube['returned'][index])
+  correctCount = int(cube['correct'][index])
+  totalCorrect = int(cube['totalCorrect'])
+  precision = correctCount / returnedCount if returnedCount != 0 else None
+  recall = correctCount / totalCorrect if totalCorrect != 0 else None
+  return precision, recall, returnedCount, correctCount, usedThresholds
+
+def main():
+  parser = argparse.ArgumentParser(description=(
+    'Builds or queries the precomputed precision/recall cube over the link '
+    'stats.'
+  ))
+  subparsers = parser.add_subparsers(dest='command', required=True)
+  subparsers.add_parser('build', help='Build the cube from the link stats.')
+  queryParser = subparsers.add_parser('query',
+    help='Get the precision and recall for some thresholds.')
+  queryParser.add_argument('--cprob', type=float)
+  queryParser.add_argument('--invCprob', type=float)
+  queryParser.add_argument('--count', type=float)
+  queryParser.add_argument('--tuples', type=float)
+  args = parser.parse_args()
+
+  if args.command == 'build':
+    linkStatsFile = open(get_synonym_sets.LINK_STATS_PATH)
+    linkStats = get_synonym_sets.readLinkStatsFile(linkStatsFile)
+    saveCube(buildCube(linkStats))
+  else:
+    cube = loadCube()
+    precision, recall, returnedCount, correctCount, thresholds = getPr(
+      cube, args.cprob, args.invCprob, args.count, args.tuples
+    )
+    print('Thresholds used: ' + ', '.join([
+      '{}={}'.format(name, threshold)
+      for (name, threshold) in zip(FEATURE_NAMES, thresholds)
+    ]))
+    print('Precision\tRecall\tReturned\tCorrect')
+    print('{}\t{}\t{}\t{}'.format(precision, recall, returnedCount,
+      correctCount))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,100 @@
+# Tests for the link stats of get_synonym_sets.py, against a small database
+# built by build_crosswikis.buildFromForwardDump().
+#
+# Usage:
+#   python -m pytest test_get_synonym_sets.py
+
+import build_crosswikis
+import constants
+import get_synonym_sets
+import metrics
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+# Rows of the raw forward dump (dictionary), in the form
+# {anchor}{TAB}{cprob} {entity} {info}.
+DUMP_ROWS = [
+  'Seattle\t0.75 Seattle W:3/4 w:3/4',
+  'Seattle\t0.25 Seattle,_Washington W:1/4',
+  'the emerald city\t1 Seattle w:2/2',
+]
+
+# Lines of the test set, in the form {entity}{TAB}{string}{TAB}{correct}.
+TEST_SET_LINES = [
+  'Seattle\tSeattle\t1',
+  'Seattle\tthe emerald city\t1',
+  'Seattle,_Washington\tseattle\t1',
+  # Not in Crosswikis.
+  'Seattle\train city\t0',
+  # Too few Open IE tuples to be looked up.
+  'Seattle\tjet city\t0',
+]
+
+# Lines of the Open IE string counts, in the form {string}{TAB}{count}.
+STRING_COUNTS_LINES = [
+  'Seattle\t100',
+  'the emerald city\t20',
+  'seattle\t100',
+  'rain city\t10',
+  'jet city\t2',
+]
+
+class LinkStatsTest(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    patches = [
+      (constants, 'CROSSWIKIS_DB_PATH',
+        os.path.join(self.tempDir, 'crosswikis.db')),
+      (constants, 'CROSSWIKIS_NUM_SHARDS', 0),
+      (constants, 'ANCHOR_BLOOM_PATH',
+        os.path.join(self.tempDir, 'anchors.bloom')),
+      (constants, 'ENTITY_BLOOM_PATH',
+        os.path.join(self.tempDir, 'entities.bloom')),
+      (get_synonym_sets, 'TEST_SET_PATH',
+        self.writeLines('cwel-test-set', TEST_SET_LINES)),
+      (get_synonym_sets, 'STRING_COUNTS_PATH',
+        self.writeLines('openie-counts', STRING_COUNTS_LINES)),
+      (get_synonym_sets, 'LINK_STATS_PATH',
+        os.path.join(self.tempDir, '1-link-stats.tsv')),
+      (get_synonym_sets, 'LINK_STORE_PATH',
+        os.path.join(self.tempDir, '1-link-stats-store.tsv')),
+      (metrics, 'METRICS_PATH',
+        os.path.join(self.tempDir, 'metrics-{driver}.prom')),
+    ]
+    for module, name, value in patches:
+      patcher = unittest.mock.patch.object(module, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+    build_crosswikis.buildFromForwardDump(
+      self.writeLines('dictionary', DUMP_ROWS),
+      table='crosswikis_subset',
+      invTable='crosswikis_inv_subset'
+    )
+
+  def writeLines(self, name, lines):
+    path = os.path.join(self.tempDir, name)
+    with open(path, 'w') as linesFile:
+      for line in lines:
+        print(line, file=linesFile)
+    return path
+
+  def readLinkStats(self):
+    with open(get_synonym_sets.LINK_STATS_PATH) as linkStatsFile:
+      return linkStatsFile.read()
+
+  def testStoreBackedRunMatchesFullRun(self):
+    get_synonym_sets.getLinkStats(incremental=False)
+    fullLinkStats = self.readLinkStats()
+    with unittest.mock.patch.object(get_synonym_sets, 'getPairStats',
+        side_effect=AssertionError('Queried a stored pair')):
+      get_synonym_sets.getLinkStats()
+    self.assertEqual(fullLinkStats, self.readLinkStats())
+    self.assertIn('Seattle\train city\t0\t0\t0\t0\t10\n', fullLinkStats)
+
+if __name__ == '__main__':
+  unittest.main()
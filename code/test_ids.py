@@ -0,0 +1,30 @@
+# Tests for the ID maps of ids.py.
+#
+# Usage:
+#   python -m pytest test_ids.py
+
+import ids
+import io
+import unittest
+
+class IdMapTest(unittest.TestCase):
+  def testWriteAndReadIdMap(self):
+    idMap = ids.newIdMap()
+    strings = [
+      'Seattle',
+      'tab\there',
+      'line\nbreak',
+      'carriage\rreturn',
+      'back\\slash\\t',
+      '',
+    ]
+    for string in strings:
+      ids.internString(idMap, string)
+    idFile = io.StringIO()
+    ids.writeIdMap(idMap, idFile)
+    self.assertEqual(len(strings), len(idFile.getvalue().splitlines()))
+    idFile.seek(0)
+    self.assertEqual(idMap, ids.readIdMap(idFile))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,105 @@
+# Tests for update_crosswikis.py, against a small database loaded by
+# build_crosswikis.buildFromForwardDump() the way dict-to-tab.sh loads the
+# dumps.
+#
+# Usage:
+#   python -m pytest test_update_crosswikis.py
+
+import build_crosswikis
+import constants
+import crosswikis
+import get_synonym_sets
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+import update_crosswikis
+
+# Rows of the raw forward dump (dictionary), in the form
+# {anchor}{TAB}{cprob} {entity} {info}.
+DUMP_ROWS = [
+  'Seattle\t0.75 Seattle W:3/4 w:3/4',
+  'Seattle\t0.25 Seattle,_Washington W:1/4',
+  'the emerald city\t1 Seattle w:2/2',
+]
+
+def toTabRow(row):
+  """Converts a dump row the way dict-to-tab.sh does, keeping the leading space
+  of the info field."""
+  anchor, rest = row.split('\t')
+  cprob, entity, info = rest.split(' ', 2)
+  return anchor, float(cprob), entity, ' ' + info
+
+class UpdateCrosswikisTest(unittest.TestCase):
+  def setUp(self):
+    self.tempDir = tempfile.mkdtemp()
+    dbPath = os.path.join(self.tempDir, 'crosswikis.db')
+    patches = [
+      (constants, 'CROSSWIKIS_DB_PATH', dbPath),
+      (constants, 'CROSSWIKIS_NUM_SHARDS', 0),
+      (constants, 'ANCHOR_BLOOM_PATH',
+        os.path.join(self.tempDir, 'anchors.bloom')),
+      (constants, 'ENTITY_BLOOM_PATH',
+        os.path.join(self.tempDir, 'entities.bloom')),
+      (update_crosswikis, 'CHANGED_KEYS_PATH',
+        os.path.join(self.tempDir, 'changed-keys.tsv')),
+      (get_synonym_sets, 'LINK_STORE_PATH',
+        os.path.join(self.tempDir, 'link-stats-store.tsv')),
+    ]
+    for module, name, value in patches:
+      patcher = unittest.mock.patch.object(module, name, value)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+    self.addCleanup(shutil.rmtree, self.tempDir)
+
+    self.dumpPath = self.writeDump(DUMP_ROWS)
+    build_crosswikis.buildFromForwardDump(self.dumpPath)
+
+  def writeDump(self, rows):
+    dumpPath = os.path.join(self.tempDir, 'dictionary-{}'.format(len(rows)))
+    with open(dumpPath, 'w') as dumpFile:
+      for row in rows:
+        print(row, file=dumpFile)
+    return dumpPath
+
+  def testForwardDumpMatchesImporter(self):
+    rows = crosswikis.queryDb(constants.CROSSWIKIS_DB_PATH,
+      'SELECT anchor, cprob, entity, info, norm_anchor FROM crosswikis', ())
+    self.assertEqual(
+      sorted([
+        toTabRow(row) + (crosswikis.normalizeString(toTabRow(row)[0]),)
+        for row in DUMP_ROWS
+      ]),
+      sorted(rows)
+    )
+    indexes = crosswikis.queryDb(constants.CROSSWIKIS_DB_PATH,
+      'SELECT name FROM sqlite_master WHERE type=\'index\'', ())
+    self.assertIn(('crosswikis_norm_anchor',), list(indexes))
+
+  def testUnchangedDumpHasNoChanges(self):
+    changedAnchors, changedEntities = update_crosswikis.updateCrosswikis(
+      self.dumpPath)
+    self.assertEqual(set(), changedAnchors)
+    self.assertEqual(set(), changedEntities)
+
+  def testChangedPair(self):
+    rows = DUMP_ROWS[:2] + ['the emerald city\t1 Seattle w:3/3']
+    changedAnchors, changedEntities = update_crosswikis.updateCrosswikis(
+      self.writeDump(rows))
+    self.assertEqual(set(['the emerald city']), changedAnchors)
+    self.assertEqual(set(['Seattle']), changedEntities)
+
+  def testNewAnchorGetsFeatures(self):
+    build_crosswikis.buildBloomFilters(tables=['crosswikis', 'crosswikis_inv'])
+    build_crosswikis.buildFeatures(tables=['crosswikis'])
+    # Caches the filter from before the update.
+    self.assertFalse(crosswikis.mightHaveAnchor('jet city'))
+    rows = DUMP_ROWS + ['Jet City\t1 Seattle w:1/1']
+    update_crosswikis.updateCrosswikis(self.writeDump(rows))
+    self.assertTrue(crosswikis.mightHaveAnchor('jet city'))
+    features = crosswikis.getAnchorFeatures('jet city', table='crosswikis')
+    self.assertIsNotNone(features)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,338 @@
+# Updates the Crosswikis tables in place from a new release of the dumps,
+# instead of rebuilding crosswikis.db from scratch.
+#
+# Each dump is sorted by (key, other column) with an external sort and merged
+# against an ordered scan of its table, so only the rows of (anchor, entity)
+# pairs that were added, removed or changed are written. If only the forward
+# dump is given, the inverse rows of every entity with a changed pair are
+# derived again from its updated numerators, which updates the entity's totals.
+#
+# The anchors whose forward rows changed and the entities whose rows changed in
+# either table are written to CHANGED_KEYS_PATH as lines of the form
+# {anchor|entity}{TAB}{key}, for invalidating downstream results, and pairs with
+# either are dropped from the link stats store (see
+# get_synonym_sets.invalidateLinkStore()). New keys are added to the Bloom
+# filters and the features of changed anchors are computed again, if they've
+# been built. Only the full tables are updated; the subset tables have to be
+# rebuilt from them.
+#
+# Usage:
+#   python update_crosswikis.py {dictPath} [{invDictPath}]
+
+import bloom
+import build_crosswikis
+import constants
+import crosswikis
+import get_synonym_sets
+import heapq
+import itertools
+import math
+import myutils
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+CHANGED_KEYS_PATH = constants.DATA_PATH + 'google-crosswikis/changed-keys.tsv'
+
+def getPairColumns(table):
+  """Gets the (key, other) columns that identify a pair in a table."""
+  keyColumn = crosswikis.getShardKeyColumn(table)
+  return keyColumn, 'anchor' if keyColumn == 'entity' else 'entity'
+
+def iterDumpPairs(dumpPath, parseRow, runDir):
+  """Yields the pairs of a raw dump in sorted order.
+
+  Args:
+    dumpPath: The path of the dump.
+    parseRow: build_crosswikis.parseForwardRow() for a forward dump, or
+      crosswikis.parseRawInvCrosswikisRow() for an inverse dump.
+    runDir: The directory to write sorted runs to.
+
+  Yields: ((key, other), rows) tuples, where rows is a sorted list of the
+    (cprob, info) tuples of the pair.
+  """
+  def iterLines():
+    with open(dumpPath) as dumpFile:
+      for row in dumpFile:
+        key, cprob, other, info = parseRow(row.rstrip('\n'))
+        yield '\t'.join([key, other, cprob, info])
+  runPaths = myutils.sortWithSpill(iterLines(), runDir,
+    build_crosswikis.SPILL_MAX_LINES)
+  lines = (line.split('\t') for line in myutils.mergeSortedLines(runPaths))
+  pairLines = itertools.groupby(lines, key=lambda parts: (parts[0], parts[1]))
+  for pair, group in pairLines:
+    yield pair, sorted([(float(parts[2]), parts[3]) for parts in group])
+
+def iterTablePairs(table):
+  """Yields the pairs of a table, across every shard, in sorted order.
+
+  Yields: ((key, other), rows) tuples, where rows is a list of the (cprob, info,
+    dbPath, rowid) tuples of the pair.
+  """
+  queryString = (
+    'SELECT {key}, {other}, cprob, info, rowid FROM {table} '
+    'ORDER BY {key}, {other}'
+  )
+  keyColumn, otherColumn = getPairColumns(table)
+  queryString = queryString.format(table=table, key=keyColumn,
+    other=otherColumn)
+  def iterShard(dbPath):
+    for key, other, cprob, info, rowid in crosswikis.queryDb(dbPath,
+        queryString, ()):
+      yield (key, other), (cprob, info, dbPath, rowid)
+  rows = heapq.merge(
+    *[iterShard(dbPath) for dbPath in crosswikis.getDbPaths()],
+    key=lambda item: item[0]
+  )
+  for pair, group in itertools.groupby(rows, key=lambda item: item[0]):
+    yield pair, [row for (pair, row) in group]
+
+def getRowKey(cprob, info):
+  """Gets a sortable key for a row that ignores how its info is spaced."""
+  return cprob, sorted(crosswikis.getLabelCounts(info).items())
+
+def rowsEqual(oldRows, newRows):
+  """Checks whether a pair's rows in a table match its rows in a dump.
+
+  The info strings are compared by their label counts, since the rows loaded
+  with dict-to-tab.sh keep a leading space that the parsed dump rows don't.
+  """
+  oldRows = sorted([
+    getRowKey(cprob, info) for (cprob, info, dbPath, rowid) in oldRows
+  ])
+  newRows = sorted([getRowKey(cprob, info) for (cprob, info) in newRows])
+  if len(oldRows) != len(newRows):
+    return False
+  return all([
+    oldCounts == newCounts and math.isclose(oldCprob, newCprob)
+    for ((oldCprob, oldCounts), (newCprob, newCounts)) in zip(oldRows, newRows)
+  ])
+
+def diffPairs(oldPairs, newPairs):
+  """Merges the sorted pairs of a table with the sorted pairs of a dump.
+
+  Yields: (pair, oldRows, newRows) for each pair that was added (with no
+    oldRows), removed (with no newRows) or changed.
+  """
+  oldPairs = iter(oldPairs)
+  newPairs = iter(newPairs)
+  oldItem = next(oldPairs, None)
+  newItem = next(newPairs, None)
+  while oldItem is not None or newItem is not None:
+    if newItem is None or (oldItem is not None and oldItem[0] < newItem[0]):
+      yield oldItem[0], oldItem[1], []
+      oldItem = next(oldPairs, None)
+    elif oldItem is None or newItem[0] < oldItem[0]:
+      yield newItem[0], [], newItem[1]
+      newItem = next(newPairs, None)
+    else:
+      if not rowsEqual(oldItem[1], newItem[1]):
+        yield oldItem[0], oldItem[1], newItem[1]
+      oldItem = next(oldPairs, None)
+      newItem = next(newPairs, None)
+
+def applyChanges(table, changes):
+  """Replaces the rows of each changed pair in a table with its new rows.
+
+  Args:
+    table: The table to update.
+    changes: A list of (pair, oldRows, newRows) tuples from diffPairs().
+  """
+  keyColumn, otherColumn = getPairColumns(table)
+  deletes = {}
+  inserts = {}
+  for (key, other), oldRows, newRows in changes:
+    for cprob, info, dbPath, rowid in oldRows:
+      deletes.setdefault(dbPath, []).append((rowid,))
+    for cprob, info in newRows:
+      inserts.setdefault(crosswikis.getKeyDbPath(key), []).append({
+        keyColumn: key,
+        otherColumn: other,
+        'cprob': cprob,
+        'info': info,
+      })
+
+  for dbPath in crosswikis.getDbPaths():
+    connection = sqlite3.connect(dbPath)
+    columns = [
+      row[1] for row in
+      connection.execute('PRAGMA table_info({table})'.format(table=table))
+    ]
+    rows = inserts.get(dbPath, [])
+    if 'norm_anchor' in columns:
+      for row in rows:
+        row['norm_anchor'] = crosswikis.normalizeString(row['anchor'])
+    connection.executemany(
+      'DELETE FROM {table} WHERE rowid=?'.format(table=table),
+      deletes.get(dbPath, [])
+    )
+    if len(rows) > 0:
+      connection.executemany(
+        'INSERT INTO {table} ({columns}) VALUES ({params})'.format(
+          table=table,
+          columns=', '.join(rows[0].keys()),
+          params=', '.join([':' + column for column in rows[0].keys()])
+        ),
+        rows
+      )
+    connection.commit()
+    connection.close()
+
+def getInverseRows(invTable, entity):
+  """Gets the rows of an entity in an inverse table.
+
+  Returns: A list of (anchor, cprob, info, dbPath, rowid) tuples.
+  """
+  dbPath = crosswikis.getKeyDbPath(entity)
+  queryString = (
+    'SELECT anchor, cprob, info, rowid FROM {table} WHERE entity=?'
+  ).format(table=invTable)
+  return [
+    (anchor, cprob, info, dbPath, rowid)
+    for (anchor, cprob, info, rowid) in
+    crosswikis.queryDb(dbPath, queryString, (entity,))
+  ]
+
+def deriveInverseChanges(forwardChanges, invTable):
+  """Derives the changes to an inverse table from the changes to its forward
+  table.
+
+  Every anchor of an entity with a changed pair gets a new row, since the
+  entity's totals may have changed.
+
+  Args:
+    forwardChanges: A list of (pair, oldRows, newRows) tuples from diffPairs()
+      for the forward table.
+    invTable: The inverse table.
+
+  Returns: A list of (pair, oldRows, newRows) tuples for the inverse table.
+  """
+  entityChanges = {}
+  for (anchor, entity), oldRows, newRows in forwardChanges:
+    entityChanges.setdefault(entity, {})[anchor] = (
+      build_crosswikis.sumNumerators([info for (cprob, info) in newRows])
+      if len(newRows) > 0 else None
+    )
+
+  changes = []
+  for entity, anchorChanges in sorted(entityChanges.items()):
+    oldRows = sorted(getInverseRows(invTable, entity))
+    oldPairs = [
+      ((entity, anchor), [row[1:] for row in group])
+      for anchor, group in itertools.groupby(oldRows, key=lambda row: row[0])
+    ]
+    anchorNumerators = dict([
+      (anchor, build_crosswikis.sumNumerators([row[1] for row in rows]))
+      for ((entity, anchor), rows) in oldPairs
+    ])
+    anchorNumerators.update(anchorChanges)
+    anchorNumerators = [
+      (anchor, numerators)
+      for (anchor, numerators) in sorted(anchorNumerators.items())
+      if numerators is not None
+    ]
+    newPairs = [
+      ((entity, anchor), [(cprob, info)])
+      for (entity, cprob, anchor, info) in
+      build_crosswikis.deriveInverseRows(entity, anchorNumerators)
+    ]
+    changes.extend(diffPairs(oldPairs, newPairs))
+  return changes
+
+def updateTable(table, dumpPath, parseRow):
+  """Updates a table to match a raw dump.
+
+  Returns: The list of (pair, oldRows, newRows) changes that were applied.
+  """
+  runDir = tempfile.mkdtemp(dir=os.path.dirname(constants.CROSSWIKIS_DB_PATH))
+  print('Diffing {} against {}'.format(table, dumpPath))
+  changes = list(diffPairs(
+    iterTablePairs(table),
+    iterDumpPairs(dumpPath, parseRow, runDir)
+  ))
+  shutil.rmtree(runDir)
+  print('Updating {} pairs in {}'.format(len(changes), table))
+  applyChanges(table, changes)
+  return changes
+
+def getAddedKeys(changes, table, column):
+  """Gets the values of a column in the pairs that were added to a table."""
+  keyColumn, otherColumn = getPairColumns(table)
+  index = 0 if column == keyColumn else 1
+  return set([
+    pair[index] for (pair, oldRows, newRows) in changes if len(oldRows) == 0
+  ])
+
+def addKeysToBloomFilters(anchors, entities):
+  """Adds new keys to the Bloom filters, if they've been built."""
+  for path, keys in [
+      (constants.ANCHOR_BLOOM_PATH, set([
+        anchor.translate(crosswikis.ASCII_CASE_FOLD) for anchor in anchors
+      ])),
+      (constants.ENTITY_BLOOM_PATH, entities)]:
+    if not os.path.exists(path):
+      continue
+    bloomFilter = bloom.loadFilter(path, writable=True)
+    for key in keys:
+      if not bloom.mightContain(bloomFilter, key):
+        bloom.addKey(bloomFilter, key)
+    bloom.saveFilter(bloomFilter, path)
+    crosswikis.reloadBloomFilter(path)
+    print('{}: {}'.format(path, bloom.formatStats(bloomFilter)))
+
+def writeChangedKeys(changedAnchors, changedEntities):
+  with open(CHANGED_KEYS_PATH, 'w') as changedKeysFile:
+    for column, keys in [('anchor', changedAnchors),
+        ('entity', changedEntities)]:
+      for key in sorted(keys):
+        print('{}\t{}'.format(column, key), file=changedKeysFile)
+
+def updateCrosswikis(dumpPath, invDumpPath=None, table='crosswikis',
+    invTable='crosswikis_inv'):
+  """Updates the forward and inverse tables from new dumps.
+
+  Args:
+    dumpPath: The path of the new forward dump (dict).
+    invDumpPath: The path of the new inverse dump (inv.dict). If not given, the
+      changes to the inverse table are derived from the forward table's.
+    table: The forward table.
+    invTable: The inverse table.
+
+  Returns: A (changedAnchors, changedEntities) tuple of sets.
+  """
+  oldDbVersion = crosswikis.getDbVersion()
+  changes = updateTable(table, dumpPath, build_crosswikis.parseForwardRow)
+  if invDumpPath is not None:
+    invChanges = updateTable(invTable, invDumpPath,
+      crosswikis.parseRawInvCrosswikisRow)
+  else:
+    invChanges = deriveInverseChanges(changes, invTable)
+    print('Updating {} pairs in {}'.format(len(invChanges), invTable))
+    applyChanges(invTable, invChanges)
+
+  addKeysToBloomFilters(
+    getAddedKeys(changes, table, 'anchor')
+      | getAddedKeys(invChanges, invTable, 'anchor'),
+    getAddedKeys(changes, table, 'entity')
+      | getAddedKeys(invChanges, invTable, 'entity')
+  )
+  # An anchor's inverse rows only change with their entity's, so the entities
+  # cover them.
+  changedAnchors = set([anchor for ((anchor, entity), o, n) in changes])
+  changedEntities = set([entity for ((anchor, entity), o, n) in changes])
+  changedEntities.update([entity for ((entity, anchor), o, n) in invChanges])
+  build_crosswikis.updateFeatures(table, changedAnchors)
+  writeChangedKeys(changedAnchors, changedEntities)
+  get_synonym_sets.invalidateLinkStore(changedAnchors, changedEntities,
+    oldDbVersion)
+  print('{} anchors and {} entities changed.'.format(len(changedAnchors),
+    len(changedEntities)))
+  return changedAnchors, changedEntities
+
+def main():
+  updateCrosswikis(*sys.argv[1:3])
+
+if __name__ == '__main__':
+  main()